@@ -0,0 +1,130 @@
+"""Streams access-log reports to CSV or Parquet.
+
+Rows come from ``access_log.history`` (monthly archives and the hot table)
+and are written in chunks of CHUNK_ROWS, so memory use stays flat however
+many years the report covers. Member and lab names are looked up from two
+small in-memory maps rather than joined per row. Parquet output needs
+pyarrow; CSV always works.
+
+    python access_export.py report.csv --lab Theory --since 2024-01-01 --until 2024-07-01
+    python access_export.py report.parquet
+"""
+import argparse
+import csv
+import itertools
+import os
+from datetime import datetime
+
+import access_log
+import database
+from lab_directory import LabDirectory
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+CHUNK_ROWS = 5000
+HEADER = ["accessID", "time_stamp", "lab_id", "lab_name", "member_id", "first_name", "last_name",
+          "access_type", "result"]
+
+
+def parse_day(text):
+    """Validates a YYYY-MM-DD date; returns it zero-padded, or None when blank."""
+    text = (text or "").strip()
+    if not text:
+        return None
+    # time stamps are compared as strings, so bounds must be in the same form
+    return datetime.strptime(text, "%Y-%m-%d").strftime("%Y-%m-%d")
+
+
+def report_rows(conn, lab_id=None, since=None, until=None):
+    """Yields one HEADER-shaped tuple per scan in the range."""
+    labs = dict(conn.execute("SELECT lab_id, lab_name FROM Lab"))
+    members = {m: (first, last) for m, first, last in conn.execute("SELECT member_id, first_name, last_name FROM LabMember")}
+    for access_id, member_id, row_lab, time_stamp, access_type, result in access_log.history(conn, since, until, lab_id):
+        first, last = members.get(member_id, (None, None))
+        yield (access_id, time_stamp, row_lab, labs.get(row_lab), member_id, first, last, access_type, result)
+
+
+def chunks(rows, size=CHUNK_ROWS):
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def export_access(conn, path, lab_id=None, since=None, until=None, progress=None, chunk_size=CHUNK_ROWS):
+    """Writes the report to path (.csv or .parquet); returns the row count.
+
+    progress, if given, is called with the running row count after each chunk.
+    The file is written under a temporary name and renamed when complete.
+    """
+    parquet = path.lower().endswith(".parquet")
+    if parquet and pq is None:
+        raise RuntimeError("Parquet export needs pyarrow; export to .csv instead.")
+
+    partial = path + ".part"
+    total = 0
+    try:
+        if parquet:
+            schema = pa.schema([
+                ("accessID", pa.int64()), ("time_stamp", pa.string()), ("lab_id", pa.int64()),
+                ("lab_name", pa.string()), ("member_id", pa.int64()), ("first_name", pa.string()),
+                ("last_name", pa.string()), ("access_type", pa.string()), ("result", pa.string()),
+            ])
+            with pq.ParquetWriter(partial, schema) as writer:
+                for chunk in chunks(report_rows(conn, lab_id, since, until), chunk_size):
+                    writer.write_table(pa.Table.from_pylist([dict(zip(HEADER, row)) for row in chunk], schema))
+                    total += len(chunk)
+                    if progress:
+                        progress(total)
+        else:
+            with open(partial, "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerow(HEADER)
+                for chunk in chunks(report_rows(conn, lab_id, since, until), chunk_size):
+                    writer.writerows(chunk)
+                    total += len(chunk)
+                    if progress:
+                        progress(total)
+        os.replace(partial, path)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the access log to CSV or Parquet.")
+    parser.add_argument("output", help="destination file, .csv or .parquet")
+    parser.add_argument("--lab", help="only this lab (by name)")
+    parser.add_argument("--since", type=parse_day, help="first day included, YYYY-MM-DD")
+    parser.add_argument("--until", type=parse_day, help="first day excluded, YYYY-MM-DD")
+    args = parser.parse_args()
+    if args.since and args.until and args.since >= args.until:
+        parser.error("--since must be before --until")
+
+    conn = database.connect()
+    database.ensure_schema(conn)
+    lab_id = None
+    if args.lab:
+        labs = LabDirectory(database.DB_PATH)
+        labs.load()
+        lab = labs.find(args.lab)
+        labs.close()
+        if lab is None:
+            parser.error(f"unknown lab {args.lab!r}")
+        lab_id = lab.lab_id
+
+    total = export_access(conn, args.output, lab_id, args.since, args.until,
+                          progress=lambda n: print(f"\r{n} rows", end="", flush=True))
+    print(f"\r[INFO] Exported {total} rows to {args.output}.")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
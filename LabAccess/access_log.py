@@ -0,0 +1,216 @@
+"""Records every scan and keeps the access log fast as it grows.
+
+``log_scan`` is the only database write on the scan path. Each thread keeps
+its own connection, so the kiosk UI, door-controller workers and inference
+processes can all log without sharing a handle.
+
+LabAccess holds only recent raw rows. Triggers (see ``database.ensure_schema``)
+keep hourly and daily per-lab, per-member counts in AccessRollupHourly and
+AccessRollupDaily, and
+
+    python access_log.py compact --days 90
+
+moves raw rows older than the retention window into one archive database per
+month (``access_archive/2024-05.db``). Recent-activity views read the hot
+table, reports read the rollups, and ``history`` walks the archives only when
+a query really spans them.
+"""
+import argparse
+import glob
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+import database
+from database import DB_PATH
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+ARCHIVE_DIR = "access_archive"
+RETENTION_DAYS = 90          # raw rows kept in LabAccess
+HOURLY_RETENTION_DAYS = 400  # hourly rollups kept; daily rollups are kept forever
+RECENT_LIMIT = 500
+COLUMNS = ["accessID", "member_id", "lab_id", "time_stamp", "access_type", "result"]
+
+_local = threading.local()
+
+
+def _connection(db_path):
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    if db_path not in conns:
+        conns[db_path] = sqlite3.connect(db_path)
+    return conns[db_path]
+
+
+def log_scan(lab_id, member_id, granted, access_type="entry", when=None, db_path=DB_PATH):
+    """Appends one scan result; returns its accessID."""
+    conn = _connection(db_path)
+    cursor = conn.execute(
+        "INSERT INTO LabAccess (member_id, lab_id, time_stamp, access_type, result) VALUES (?,?,?,?,?)",
+        (member_id, lab_id, (when or datetime.now()).strftime(TIME_FORMAT), access_type,
+         "granted" if granted else "denied"),
+    )
+    conn.commit()
+    return cursor.lastrowid
+
+
+# ---------- queries ----------
+
+def recent(conn, limit=RECENT_LIMIT, lab_id=None):
+    """Newest raw rows first; returns (rows, column_names)."""
+    where, params = ("WHERE lab_id = ?", [lab_id]) if lab_id is not None else ("", [])
+    cursor = conn.execute(
+        f"SELECT {', '.join(COLUMNS)} FROM LabAccess {where} ORDER BY time_stamp DESC LIMIT ?",
+        params + [limit],
+    )
+    return cursor.fetchall(), [d[0] for d in cursor.description]
+
+
+def rollups(conn, period="day", since=None, until=None, lab_id=None):
+    """(period, lab_id, member_id, granted, denied) rows, oldest first."""
+    table = "AccessRollupHourly" if period == "hour" else "AccessRollupDaily"
+    clauses, params = _range_filter("period", since, until, lab_id)
+    return conn.execute(
+        f"SELECT period, lab_id, member_id, granted, denied FROM {table} {clauses} ORDER BY period",
+        params,
+    ).fetchall()
+
+
+def archives(archive_dir=ARCHIVE_DIR):
+    """{"YYYY-MM": path} for every monthly archive on disk."""
+    paths = glob.glob(os.path.join(archive_dir, "????-??.db"))
+    return {os.path.basename(p)[:-3]: p for p in sorted(paths)}
+
+
+def history(conn, since=None, until=None, lab_id=None, archive_dir=ARCHIVE_DIR):
+    """Yields raw rows from the monthly archives, oldest first, then the hot table.
+
+    Only archives whose month overlaps [since, until) are attached, one at a
+    time, so the generator stays cheap for recent ranges.
+    """
+    clauses, params = _range_filter("time_stamp", since, until, lab_id)
+    select = f"SELECT {', '.join(COLUMNS)} FROM {{}}.LabAccess {clauses} ORDER BY time_stamp"
+    for month, path in archives(archive_dir).items():
+        if (since and month < since[:7]) or (until and month > until[:7]):
+            continue
+        conn.execute("ATTACH DATABASE ? AS archive", (path,))
+        try:
+            yield from conn.execute(select.format("archive"), params)
+        finally:
+            conn.execute("DETACH DATABASE archive")
+    yield from conn.execute(select.format("main"), params)
+
+
+def _range_filter(column, since, until, lab_id):
+    clauses, params = [], []
+    if since:
+        clauses.append(f"{column} >= ?")
+        params.append(since)
+    if until:
+        clauses.append(f"{column} < ?")
+        params.append(until)
+    if lab_id is not None:
+        clauses.append("lab_id = ?")
+        params.append(lab_id)
+    return ("WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+
+# ---------- retention ----------
+
+def _unsynced_floor(conn):
+    """Rows above this accessID have not reached the central node yet."""
+    try:
+        row = conn.execute("SELECT value FROM SyncState WHERE key = 'last_pushed_access'").fetchone()
+    except sqlite3.OperationalError:
+        return None  # not a kiosk; nothing waits to be pushed
+    return row[0] if row else 0
+
+
+def compact(conn, retention_days=RETENTION_DAYS, archive_dir=ARCHIVE_DIR, vacuum=False):
+    """Moves raw rows older than retention_days into monthly archives.
+
+    Rollups are already up to date, so this only moves raw rows. Rows a kiosk
+    has not pushed to the central node yet stay put, and so does the newest
+    row: accessID has no AUTOINCREMENT, so deleting it would let the next scan
+    reuse an ID that was already pushed and archived. Returns rows archived.
+    """
+    cutoff = (datetime.now() - timedelta(days=retention_days)).strftime(TIME_FORMAT)
+    where, params = "time_stamp < ? AND accessID < (SELECT MAX(accessID) FROM main.LabAccess)", [cutoff]
+    floor = _unsynced_floor(conn)
+    if floor is not None:
+        where += " AND accessID <= ?"
+        params.append(floor)
+
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(LabAccess)")]
+    column_list = ", ".join(columns)
+    months = [m for (m,) in conn.execute(
+        f"SELECT DISTINCT substr(time_stamp, 1, 7) FROM LabAccess WHERE {where}", params
+    )]
+    os.makedirs(archive_dir, exist_ok=True)
+    moved = 0
+    for month in months:
+        conn.execute("ATTACH DATABASE ? AS archive", (os.path.join(archive_dir, f"{month}.db"),))
+        try:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS archive.LabAccess AS SELECT {column_list} FROM main.LabAccess WHERE 0")
+            # LabAccess may have gained columns since this archive was created
+            existing = {row[1] for row in conn.execute("PRAGMA archive.table_info(LabAccess)")}
+            for column in columns:
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE archive.LabAccess ADD COLUMN {column}")
+            conn.execute("CREATE INDEX IF NOT EXISTS archive.LabAccess_time ON LabAccess (time_stamp)")
+            month_where = f"{where} AND substr(time_stamp, 1, 7) = ?"
+            with conn:
+                conn.execute(
+                    f"INSERT INTO archive.LabAccess ({column_list}) SELECT {column_list} FROM main.LabAccess WHERE {month_where}",
+                    params + [month],
+                )
+                moved += conn.execute(f"DELETE FROM main.LabAccess WHERE {month_where}", params + [month]).rowcount
+        finally:
+            conn.execute("DETACH DATABASE archive")
+
+    hour_cutoff = (datetime.now() - timedelta(days=HOURLY_RETENTION_DAYS)).strftime("%Y-%m-%d %H")
+    with conn:
+        conn.execute("DELETE FROM AccessRollupHourly WHERE period < ?", (hour_cutoff,))
+    if vacuum and moved:
+        conn.execute("VACUUM")
+    return moved
+
+
+def print_summary(conn, days=7, lab_id=None):
+    since = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+    totals = {}
+    for period, _, _, granted, denied in rollups(conn, "day", since=since, lab_id=lab_id):
+        day = totals.setdefault(period, [0, 0])
+        day[0] += granted
+        day[1] += denied
+    for period, (granted, denied) in sorted(totals.items()):
+        print(f"{period}  granted {granted:6d}  denied {denied:6d}")
+    raw = conn.execute("SELECT COUNT(*) FROM LabAccess").fetchone()[0]
+    print(f"Raw rows in LabAccess: {raw}; monthly archives: {len(archives())}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the partitioned access log.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    compact_cmd = sub.add_parser("compact", help="archive raw rows past the retention window")
+    compact_cmd.add_argument("--days", type=int, default=RETENTION_DAYS)
+    compact_cmd.add_argument("--vacuum", action="store_true", help="shrink the database afterwards")
+    summary_cmd = sub.add_parser("summary", help="daily totals from the rollups")
+    summary_cmd.add_argument("--days", type=int, default=7)
+    summary_cmd.add_argument("--lab-id", type=int)
+    args = parser.parse_args()
+
+    conn = database.connect()
+    database.ensure_schema(conn)
+    if args.command == "compact":
+        moved = compact(conn, args.days, vacuum=args.vacuum)
+        print(f"[INFO] Archived {moved} access rows older than {args.days} days.")
+    else:
+        print_summary(conn, args.days, args.lab_id)
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
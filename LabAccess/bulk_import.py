@@ -0,0 +1,241 @@
+"""Headless bulk enrollment from a CSV manifest of ID photos.
+
+The manifest has a header row with the columns ``name``, ``lab`` (lab name or
+id) and ``image`` (path, relative to the manifest). Faces are detected by a
+pool of worker processes, cropped the same way as the kiosk's Register Face
+button, then embedded in batches. Finished rows are checkpointed in the
+ImportStaging table as they complete, so an interrupted import picks up where
+it stopped; once every row is processed, all successful rows are written to
+LabMember in a single transaction, with their photos in the face store.
+
+    python bulk_import.py students.csv --workers 4 --report students_report.csv
+"""
+import argparse
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import cv2
+
+import config
+import database
+import sync
+from face_store import store as face_store
+from lab_directory import LabDirectory
+
+BATCH_SIZE = 32     # faces embedded per forward pass
+WORKERS = os.cpu_count() or 2
+
+_detector = None
+
+
+def _init_worker():
+    """Creates one MediaPipe detector per worker process."""
+    global _detector
+    from mediapipe.tasks import python
+    from mediapipe.tasks.python import vision
+
+    base_options = python.BaseOptions(model_asset_path="detector.tflite")
+    options = vision.FaceDetectorOptions(base_options=base_options)
+    _detector = vision.FaceDetector.create_from_options(options)
+
+
+def _detect(path):
+    """Worker: returns (jpeg crop bytes, None) or (None, error message)."""
+    import mediapipe as mp
+    from PIL import Image
+
+    frame = cv2.imread(path)
+    if frame is None:
+        return None, "cannot read image"
+    result = _detector.detect(mp.Image(image_format=mp.ImageFormat.SRGB, data=frame))
+    if not result.detections:
+        return None, "no face found"
+    box = max((d.bounding_box for d in result.detections), key=lambda b: b.width * b.height)
+    face = frame[box.origin_y:box.origin_y + box.height, box.origin_x:box.origin_x + box.width]
+    if face.size == 0:
+        return None, "face outside image"
+
+    buffer = BytesIO()
+    Image.fromarray(cv2.cvtColor(face, cv2.COLOR_BGR2RGB)).save(buffer, format="JPEG")
+    return buffer.getvalue(), None
+
+
+def ensure_staging(conn):
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS ImportStaging ("
+        "manifest TEXT, line INTEGER, source TEXT, status TEXT, message TEXT, "
+        "first_name TEXT, last_name TEXT, lab_id INTEGER, facial_id BLOB, face_template BLOB, "
+        "member_id INTEGER, PRIMARY KEY (manifest, line))"
+    )
+    conn.commit()
+
+
+def read_manifest(path):
+    """Returns [(line, name, lab, image_path)] with image paths made absolute."""
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        missing = {"name", "lab", "image"} - set(reader.fieldnames or [])
+        if missing:
+            raise ValueError(f"manifest is missing columns: {', '.join(sorted(missing))}")
+        return [
+            (line, row["name"].strip(), row["lab"].strip(), os.path.join(base, row["image"].strip()))
+            for line, row in enumerate(reader, start=2)
+        ]
+
+
+def split_name(name):
+    first, _, last = name.partition(" ")
+    return first, last.strip()
+
+
+class BulkImporter:
+    def __init__(self, conn, manifest, workers=WORKERS, batch_size=BATCH_SIZE, progress=print):
+        self.conn = conn
+        self.manifest = os.path.abspath(manifest)
+        self.workers = workers
+        self.batch_size = batch_size
+        self.progress = progress
+        self.labs = LabDirectory(database.DB_PATH)
+        self.labs.load()
+
+    def run(self):
+        rows = read_manifest(self.manifest)
+        todo = self._pending(rows)
+        self.progress(f"[INFO] {len(rows) - len(todo)} of {len(rows)} rows already processed.")
+
+        valid = []
+        for line, name, lab, image in todo:
+            error = self._validate(name, lab, image)
+            if error:
+                self._stage(line, (name, lab, image), "failed", error)
+            else:
+                valid.append((line, name, lab, image))
+        self.conn.commit()
+
+        with ProcessPoolExecutor(self.workers, initializer=_init_worker) as pool:
+            detections = pool.map(_detect, [row[3] for row in valid], chunksize=4)
+            batch = []
+            for row, (crop, error) in zip(valid, detections):
+                if error:
+                    self._stage(row[0], row[1:], "failed", error)
+                    continue
+                batch.append((row, crop))
+                if len(batch) >= self.batch_size:
+                    self._embed_batch(batch)
+                    batch = []
+            if batch:
+                self._embed_batch(batch)
+
+        imported = self._commit_members()
+        self.labs.close()
+        return imported
+
+    def write_report(self, path):
+        rows = self.conn.execute(
+            "SELECT line, source, status, message, member_id FROM ImportStaging WHERE manifest = ? ORDER BY line",
+            (self.manifest,),
+        ).fetchall()
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["line", "name", "lab", "image", "status", "message", "member_id"])
+            for line, source, status, message, member_id in rows:
+                writer.writerow([line, *source.split("|", 2), status, message or "", member_id or ""])
+        return rows
+
+    # ---------- internals ----------
+
+    def _pending(self, rows):
+        done = dict(self.conn.execute(
+            "SELECT line, source FROM ImportStaging WHERE manifest = ? AND status != 'failed'",
+            (self.manifest,),
+        ).fetchall())
+        # a row is redone if it failed or the manifest line changed since
+        return [row for row in rows if done.get(row[0]) != "|".join(row[1:])]
+
+    def _validate(self, name, lab, image):
+        if not name:
+            return "missing name"
+        if self._lab_id(lab) is None:
+            return f"unknown lab {lab!r}"
+        if not os.path.isfile(image):
+            return "image not found"
+        return None
+
+    def _lab_id(self, lab):
+        found = self.labs.get(int(lab)) if lab.isdigit() else self.labs.find(lab)
+        return found.lab_id if found else None
+
+    def _stage(self, line, source, status, message=None, facial_id=None, template=None):
+        name, lab, _ = source
+        first_name, last_name = split_name(name)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO ImportStaging (manifest, line, source, status, message, first_name, "
+            "last_name, lab_id, facial_id, face_template) VALUES (?,?,?,?,?,?,?,?,?,?)",
+            (self.manifest, line, "|".join(source), status, message, first_name, last_name,
+             self._lab_id(lab), facial_id, template),
+        )
+
+    def _embed_batch(self, batch):
+        # imported here so spawned detection workers don't load the model
+        import facial_recognition as fr
+
+        faces = [fr.decode_face(crop) for _, crop in batch]
+        embeddings = fr.embed_faces(faces)
+        for ((line, *source), crop), embedding in zip(batch, embeddings):
+            self._stage(line, source, "ready", None, crop, fr.encode_template(embedding))
+        # checkpoint: a restart skips everything staged so far
+        self.conn.commit()
+        self.progress(f"[INFO] Embedded {len(batch)} faces.")
+
+    def _commit_members(self):
+        ready = self.conn.execute(
+            "SELECT line, first_name, last_name, facial_id, face_template, lab_id FROM ImportStaging "
+            "WHERE manifest = ? AND status = 'ready' ORDER BY line",
+            (self.manifest,),
+        ).fetchall()
+        # store writes are idempotent, so doing them first is safe to repeat
+        refs = [face_store.put(row[3]) for row in ready]
+        model = config.load()["model"]
+        with self.conn:
+            for (line, first_name, last_name, _, template, lab_id), face_ref in zip(ready, refs):
+                cursor = self.conn.execute(
+                    "INSERT INTO LabMember (first_name, last_name, face_ref, face_template, template_model, lab_id) "
+                    "VALUES (?,?,?,?,?,?)",
+                    (first_name, last_name, face_ref, template, model, lab_id),
+                )
+                self.conn.execute(
+                    "UPDATE ImportStaging SET status = 'imported', member_id = ?, facial_id = NULL, "
+                    "face_template = NULL WHERE manifest = ? AND line = ?",
+                    (cursor.lastrowid, self.manifest, line),
+                )
+        return len(ready)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Enroll many lab members from a CSV manifest.")
+    parser.add_argument("manifest", help="CSV with name, lab and image columns")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="face detection processes")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="faces per embedding batch")
+    parser.add_argument("--report", help="where to write the per-row report (default: <manifest>_report.csv)")
+    args = parser.parse_args()
+
+    conn = database.connect()
+    if sync.is_replica(conn):
+        parser.error("this database is a synced kiosk replica; import on the central node")
+    database.ensure_schema(conn)
+    ensure_staging(conn)
+
+    importer = BulkImporter(conn, args.manifest, args.workers, args.batch_size)
+    imported = importer.run()
+    report_path = args.report or os.path.splitext(args.manifest)[0] + "_report.csv"
+    rows = importer.write_report(report_path)
+    failed = sum(1 for row in rows if row[2] == "failed")
+    print(f"[INFO] Imported {imported} members, {failed} rows failed. Report: {report_path}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""Measures false accepts and false rejects and recommends a match threshold.
+
+The labeled set is a directory with one sub-directory per person:
+
+    calibration/alice/1.jpg, calibration/alice/2.jpg, calibration/bob/1.jpg, ...
+
+A face is detected in every image and the crops are embedded in batches with
+the kiosk's own model. All pairs are then compared in blocks: pairs of one
+person give the genuine distances, pairs of two people the impostor ones.
+Both are binned on a 0.001 grid, so memory does not grow with the pair count.
+
+From the binned distributions the tool prints the equal error rate and the
+threshold that keeps the false accept rate under --target-far with the fewest
+false rejects, optionally writes ROC/DET curves, and with --save stores that
+threshold in labaccess.json, where facial_recognition reads it. --save is
+refused when the set is too small to measure the target FAR or the threshold
+would reject every genuine pair, unless --force is given.
+
+    python calibrate.py calibration/
+    python calibrate.py calibration/ --target-far 0.0001 --curves curves.csv --plot det.png --save
+"""
+import argparse
+import os
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+import config
+
+try:
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+except ImportError:
+    plt = None
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+EMBED_BATCH = 64
+BLOCK_ROWS = 2048
+GRID = np.linspace(0.0, 2.0, 2001)  # candidate thresholds; embeddings are unit length
+TARGET_FAR = 0.001
+
+
+def labeled_images(root):
+    """Yields (label, path) for every image under root/<label>/."""
+    for label in sorted(os.listdir(root)):
+        folder = os.path.join(root, label)
+        if not os.path.isdir(folder):
+            continue
+        for name in sorted(os.listdir(folder)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield label, os.path.join(folder, name)
+
+
+def embed_set(fr, root):
+    """Returns (labels, embeddings) for every image with a detectable face."""
+    labels, embeddings, batch, batch_labels = [], [], [], []
+
+    def flush():
+        if batch:
+            embeddings.append(fr.embed_faces(batch))
+            labels.extend(batch_labels)
+            batch.clear()
+            batch_labels.clear()
+
+    for label, path in labeled_images(root):
+        frame = cv2.imread(path)
+        face = fr.find_main_face(fr.to_mp_image(frame)) if frame is not None else None
+        if face is None:
+            print(f"[WARN] No face found in {path}.")
+            continue
+        # copy: find_main_face returns a view into the frame
+        batch.append(face.copy())
+        batch_labels.append(label)
+        if len(batch) == EMBED_BATCH:
+            flush()
+    flush()
+    if not embeddings:
+        return np.array([]), np.empty((0, 512), dtype=np.float32)
+    return np.array(labels), np.concatenate(embeddings)
+
+
+def distance_histograms(labels, vectors, block=BLOCK_ROWS):
+    """Genuine and impostor pair counts per GRID bin (the last bin is open-ended)."""
+    _, ids = np.unique(labels, return_inverse=True)
+    norms = np.einsum("ij,ij->i", vectors, vectors)
+    edges = np.append(GRID, np.inf)
+    genuine = np.zeros(len(GRID), dtype=np.int64)
+    impostor = np.zeros(len(GRID), dtype=np.int64)
+    n = len(vectors)
+    for i0 in range(0, n, block):
+        a = vectors[i0:i0 + block]
+        for j0 in range(i0, n, block):
+            b = vectors[j0:j0 + block]
+            dist = np.sqrt(np.maximum(norms[i0:i0 + block, None] + norms[None, j0:j0 + block] - 2.0 * (a @ b.T), 0))
+            same = ids[i0:i0 + block, None] == ids[None, j0:j0 + block]
+            keep = np.ones(dist.shape, dtype=bool)
+            if i0 == j0:
+                keep = np.triu(keep, 1)
+            genuine += np.histogram(dist[keep & same], edges)[0]
+            impostor += np.histogram(dist[keep & ~same], edges)[0]
+    return genuine, impostor
+
+
+def error_rates(genuine, impostor):
+    """FAR and FRR at each GRID threshold, accepting distances below it."""
+    # pairs with distance < GRID[k] fall in bins 0..k-1
+    accepted_genuine = np.concatenate([[0], np.cumsum(genuine)[:-1]])
+    accepted_impostor = np.concatenate([[0], np.cumsum(impostor)[:-1]])
+    far = accepted_impostor / max(impostor.sum(), 1)
+    frr = 1.0 - accepted_genuine / max(genuine.sum(), 1)
+    return far, frr
+
+
+def calibrate(genuine, impostor, target_far=TARGET_FAR):
+    far, frr = error_rates(genuine, impostor)
+    eer_idx = int(np.argmin(np.abs(far - frr)))
+    allowed = np.flatnonzero(far <= target_far)
+    if allowed.size:
+        # fewest false rejects; where several thresholds tie, take the middle
+        # one so both distributions keep a margin
+        best = allowed[frr[allowed] == frr[allowed].min()]
+        rec_idx = int(best[len(best) // 2])
+    else:
+        rec_idx = 0
+    return {
+        "genuine_pairs": int(genuine.sum()),
+        "impostor_pairs": int(impostor.sum()),
+        "eer": float((far[eer_idx] + frr[eer_idx]) / 2),
+        "eer_threshold": float(GRID[eer_idx]),
+        "threshold": float(GRID[rec_idx]),
+        "far": float(far[rec_idx]),
+        "frr": float(frr[rec_idx]),
+        "target_far": target_far,
+    }, far, frr
+
+
+def print_calibration(result, current):
+    far_cur, frr_cur = result["current"]
+    print(f"Genuine pairs:  {result['genuine_pairs']}")
+    print(f"Impostor pairs: {result['impostor_pairs']}")
+    print(f"EER:            {result['eer']:.3%} at threshold {result['eer_threshold']:.3f}")
+    print(f"Current:        threshold {current:.3f}  FAR {far_cur:.4%}  FRR {frr_cur:.3%}")
+    print(f"Recommended:    threshold {result['threshold']:.3f}  FAR {result['far']:.4%}  "
+          f"FRR {result['frr']:.3%}  (FAR <= {result['target_far']:.4%})")
+    problem = unreliable(result)
+    if problem:
+        print(f"[WARN] {problem}")
+
+
+def unreliable(result):
+    """Why the recommended threshold should not be used, or None."""
+    if result["genuine_pairs"] < 100 or result["impostor_pairs"] < 1 / max(result["target_far"], 1e-9):
+        return "Too few pairs to measure this FAR reliably; add more people or images."
+    if result["frr"] >= 1.0:
+        return "The recommended threshold rejects every genuine pair; no threshold meets the target FAR."
+    return None
+
+
+def write_curves(path, far, frr):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("threshold,far,frr\n")
+        for t, a, r in zip(GRID, far, frr):
+            f.write(f"{t:.3f},{a:.8f},{r:.8f}\n")
+
+
+def plot_curves(path, far, frr, result):
+    if plt is None:
+        print("[WARN] matplotlib is not installed; skipping the plot.")
+        return
+    from statistics import NormalDist
+    probit = np.vectorize(lambda p: NormalDist().inv_cdf(min(max(p, 1e-6), 1 - 1e-6)))
+    fig, (roc, det) = plt.subplots(1, 2, figsize=(10, 4.5))
+    roc.plot(far, 1 - frr)
+    roc.set_xscale("log")
+    roc.set_xlabel("false accept rate")
+    roc.set_ylabel("true accept rate")
+    roc.set_title("ROC")
+    det.plot(probit(far), probit(frr))
+    ticks = [0.0001, 0.001, 0.01, 0.05, 0.2, 0.5]
+    for axis in (det.set_xticks, det.set_yticks):
+        axis(probit(ticks), [f"{t:g}" for t in ticks])
+    det.set_xlabel("false accept rate")
+    det.set_ylabel("false reject rate")
+    det.set_title(f"DET (EER {result['eer']:.2%})")
+    for ax in (roc, det):
+        ax.grid(True, alpha=0.3)
+    fig.tight_layout()
+    fig.savefig(path)
+    print(f"[INFO] Wrote {path}.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate the face match threshold on a labeled image set.")
+    parser.add_argument("images", help="directory with one sub-directory of images per person")
+    parser.add_argument("--target-far", type=float, default=TARGET_FAR, help="highest acceptable false accept rate")
+    parser.add_argument("--curves", help="write threshold,far,frr rows to this CSV")
+    parser.add_argument("--plot", help="write ROC and DET curves to this image (needs matplotlib)")
+    parser.add_argument("--save", action="store_true", help="store the recommended threshold in labaccess.json")
+    parser.add_argument("--force", action="store_true", help="save even if the calibration looks unreliable")
+    args = parser.parse_args()
+
+    import facial_recognition as fr
+
+    labels, vectors = embed_set(fr, args.images)
+    if len(set(labels)) < 2:
+        parser.error("need images of at least two people")
+    print(f"[INFO] Embedded {len(labels)} faces of {len(set(labels))} people.")
+
+    genuine, impostor = distance_histograms(labels, vectors)
+    result, far, frr = calibrate(genuine, impostor, args.target_far)
+    current = min(int(np.searchsorted(GRID, fr.MATCH_THRESHOLD)), len(GRID) - 1)
+    result["current"] = (float(far[current]), float(frr[current]))
+    print_calibration(result, fr.MATCH_THRESHOLD)
+
+    if args.curves:
+        write_curves(args.curves, far, frr)
+    if args.plot:
+        plot_curves(args.plot, far, frr, result)
+    problem = unreliable(result)
+    if args.save and problem and not args.force:
+        print("[WARN] Not saving the threshold; rerun with --force to save it anyway.")
+    elif args.save:
+        config.save({
+            "match_threshold": result["threshold"],
+            "calibration": {
+                "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "images": len(labels),
+                "people": len(set(labels)),
+                **{k: result[k] for k in ("eer", "far", "frr", "target_far")},
+            },
+        })
+        print(f"[INFO] Saved match threshold {result['threshold']:.3f} to {config.CONFIG_PATH}.")
+    fr.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Measures the recognition cascade against the full model on probe images.
+
+Every probe face is matched twice against the same lab: once with the full
+vggface2 embedding only and once through the cascade. The report shows the
+average latency of each, how many scans the fast stage settled, and every
+probe whose decision changed.
+
+    python cascade_eval.py --lab Theory probes/*.jpg
+    python cascade_eval.py --lab Theory --enrolled    # reuse enrollment crops
+"""
+import argparse
+import time
+
+import cv2
+
+import database
+import facial_recognition as fr
+from face_store import load_member_image
+from lab_directory import LabDirectory
+
+
+def load_probes(args, lab_id):
+    """Yields (label, BGR face crop) for every probe."""
+    if args.enrolled:
+        conn = database.connect()
+        rows = conn.execute(
+            "SELECT member_id, first_name, face_ref FROM LabMember WHERE lab_id = ?", (lab_id,)
+        ).fetchall()
+        for member_id, name, face_ref in rows:
+            blob = load_member_image(conn, member_id, face_ref)
+            face = fr.decode_face(blob) if blob is not None else None
+            if face is not None:
+                yield f"enrolled:{name}", face
+        conn.close()
+    for path in args.images:
+        frame = cv2.imread(path)
+        face = fr.find_main_face(fr.to_mp_image(frame)) if frame is not None else None
+        if face is None:
+            print(f"[WARN] No face found in {path}.")
+            continue
+        yield path, face
+
+
+def timed_match(face, lab_id, cascade):
+    start = time.perf_counter()
+    result = fr.match_face(face, lab_id, cascade=cascade)
+    return result, time.perf_counter() - start
+
+
+def evaluate(probes, lab_id):
+    # load both galleries first so neither side pays for it
+    fr.gallery.lab_embeddings(lab_id)
+    fr.fast_gallery.lab_embeddings(lab_id)
+
+    rows = []
+    for label, face in probes:
+        full, full_time = timed_match(face, lab_id, cascade=False)
+        cascaded, cascade_time = timed_match(face, lab_id, cascade=True)
+        rows.append((label, full, full_time, cascaded, cascade_time))
+    return rows
+
+
+def print_evaluation(rows):
+    if not rows:
+        print("No probes to evaluate.")
+        return
+    n = len(rows)
+    full_ms = 1000 * sum(r[2] for r in rows) / n
+    cascade_ms = 1000 * sum(r[4] for r in rows) / n
+    fast = sum(1 for r in rows if r[3][2] == "fast")
+    changed = [r for r in rows if r[1][:2] != r[3][:2]]
+
+    print(f"Probes:            {n}")
+    print(f"Full model:        {full_ms:.1f} ms/scan")
+    print(f"Cascade:           {cascade_ms:.1f} ms/scan ({full_ms / cascade_ms:.2f}x)")
+    print(f"Fast stage decided {fast}/{n} ({fast / n:.0%})")
+    print(f"Decision changes:  {len(changed)}")
+    for label, full, _, cascaded, _ in changed:
+        print(f"  {label}: full={full[:2]} cascade={cascaded[:2]} ({cascaded[2]} stage)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the recognition cascade with the full model.")
+    parser.add_argument("--lab", required=True, help="lab name to match against")
+    parser.add_argument("--enrolled", action="store_true", help="also probe with the lab's enrollment crops")
+    parser.add_argument("--accept-margin", type=float, default=fr.CASCADE_ACCEPT_MARGIN)
+    parser.add_argument("--reject-margin", type=float, default=fr.CASCADE_REJECT_MARGIN)
+    parser.add_argument("images", nargs="*", help="probe photos (a face is detected in each)")
+    args = parser.parse_args()
+
+    labs = LabDirectory(database.DB_PATH)
+    labs.load()
+    lab = labs.find(args.lab)
+    labs.close()
+    if lab is None:
+        parser.error(f"unknown lab {args.lab!r}")
+
+    fr.CASCADE_ACCEPT_MARGIN = args.accept_margin
+    fr.CASCADE_REJECT_MARGIN = args.reject_margin
+    print_evaluation(evaluate(load_probes(args, lab.lab_id), lab.lab_id))
+    fr.close()
+
+
+if __name__ == "__main__":
+    main()
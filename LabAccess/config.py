@@ -0,0 +1,41 @@
+"""Per-deployment settings kept in labaccess.json next to the database.
+
+Tools that tune the kiosk (such as ``calibrate.py``) write here, and modules
+read their defaults from ``load()`` at import time. Missing keys fall back
+to DEFAULTS, so the file only needs to hold what differs.
+"""
+import json
+import os
+import tempfile
+
+CONFIG_PATH = "labaccess.json"
+DEFAULTS = {
+    "match_threshold": 0.6,  # max embedding distance accepted as the same person
+    "model": "vggface2",     # embedding model the LabMember templates belong to
+    "shadow_model": None,    # candidate model scored alongside live scans
+}
+
+
+def _read(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as exc:
+        print(f"[WARN] Ignoring unreadable {path}: {exc}")
+        return {}
+
+
+def load(path=CONFIG_PATH) -> dict:
+    return {**DEFAULTS, **_read(path)}
+
+
+def save(updates, path=CONFIG_PATH) -> dict:
+    """Merges updates into the file and returns the full settings."""
+    stored = {**_read(path), **updates}
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(stored, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+    return {**DEFAULTS, **stored}
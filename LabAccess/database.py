@@ -0,0 +1,106 @@
+"""Shared SQLite schema for the kiosk app and the headless tools."""
+import sqlite3
+
+import config
+
+DB_PATH = "thedatabase.db"
+
+
+def connect(db_path=DB_PATH):
+    return sqlite3.connect(db_path)
+
+
+def add_missing_columns(cursor, table_name, columns):
+    cursor.execute(f"PRAGMA table_info({table_name})")
+    existing = {row[1] for row in cursor.fetchall()}
+    for col, col_type in columns.items():
+        if col not in existing:
+            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN {col} {col_type}")
+
+
+def ensure_schema(conn):
+    """Creates missing tables and columns; safe to run on every start."""
+    cursor = conn.cursor()
+    cursor.execute("CREATE TABLE IF NOT EXISTS Lab (lab_id INTEGER PRIMARY KEY, lab_name TEXT, facial_id TEXT)")
+    cursor.execute("CREATE TABLE IF NOT EXISTS LabMember (member_id INTEGER PRIMARY KEY, first_name TEXT, last_name TEXT, facial_id BLOB, lab_id INTEGER)")
+    cursor.execute("CREATE TABLE IF NOT EXISTS LabAccess (accessID INTEGER PRIMARY KEY, member_id INTEGER, lab_id INTEGER, time_stamp TEXT, access_type TEXT, result TEXT, FOREIGN KEY(member_id) REFERENCES LabMember(member_id), FOREIGN KEY(lab_id) REFERENCES Lab(lab_id))")
+    add_missing_columns(cursor, "Lab", {"building": "TEXT", "room": "TEXT"})
+    # precomputed embedding, encoded by template_codecs
+    add_missing_columns(cursor, "LabMember", {"face_template": "BLOB"})
+    # sha256 of the enrollment image in face_store; replaces the inline facial_id
+    add_missing_columns(cursor, "LabMember", {"face_ref": "TEXT"})
+    # embedding model face_template was made with; galleries ignore templates of other models
+    cursor.execute("PRAGMA table_info(LabMember)")
+    if "template_model" not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute("ALTER TABLE LabMember ADD COLUMN template_model TEXT")
+        cursor.execute("UPDATE LabMember SET template_model = ? WHERE face_template IS NOT NULL",
+                       (config.load()["model"],))
+    cursor.execute("CREATE TABLE IF NOT EXISTS TemplateCodebook (codebook_id INTEGER PRIMARY KEY, created TEXT, data BLOB)")
+    # templates per embedding model, filled by reembed.py before a model change and
+    # replicated to kiosks; face_ref records which image each template was made from
+    cursor.execute("CREATE TABLE IF NOT EXISTS LabMemberTemplate (member_id INTEGER, model TEXT, template BLOB, face_ref TEXT, created TEXT, PRIMARY KEY (member_id, model))")
+    ensure_access_rollups(cursor)
+    ensure_catalog_version(cursor)
+    conn.commit()
+
+
+CATALOG_TABLES = ["Lab", "LabMember", "LabMemberTemplate", "TemplateCodebook"]
+
+
+def ensure_catalog_version(cursor):
+    """A counter that triggers bump on every write to CATALOG_TABLES.
+
+    Caches of labs and galleries compare it instead of ``PRAGMA data_version``
+    alone, which also changes with every logged scan.
+    """
+    cursor.execute("CREATE TABLE IF NOT EXISTS CatalogVersion (version INTEGER)")
+    cursor.execute("INSERT INTO CatalogVersion (version) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM CatalogVersion)")
+    for table in CATALOG_TABLES:
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_version AFTER {event} ON {table} "
+                "BEGIN UPDATE CatalogVersion SET version = version + 1; END"
+            )
+
+
+def catalog_version(conn):
+    """Current CatalogVersion, or None on a database whose schema predates it."""
+    try:
+        row = conn.execute("SELECT version FROM CatalogVersion").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+
+ROLLUP_TABLES = {"AccessRollupHourly": 13, "AccessRollupDaily": 10}  # table -> time_stamp prefix length
+
+
+def ensure_access_rollups(cursor):
+    """Per-lab, per-member scan counts by hour and day, kept current by triggers.
+
+    Denied scans have no member; they are counted under member_id 0.
+    """
+    cursor.execute("CREATE INDEX IF NOT EXISTS LabAccess_time ON LabAccess (time_stamp)")
+    for table, width in ROLLUP_TABLES.items():
+        cursor.execute(f"SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = '{table}'")
+        exists = cursor.fetchone() is not None
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} (period TEXT, lab_id INTEGER, member_id INTEGER, "
+            "granted INTEGER DEFAULT 0, denied INTEGER DEFAULT 0, PRIMARY KEY (period, lab_id, member_id))"
+        )
+        cursor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {table}_count AFTER INSERT ON LabAccess BEGIN "
+            f"INSERT INTO {table} (period, lab_id, member_id, granted, denied) VALUES ("
+            f"substr(NEW.time_stamp, 1, {width}), NEW.lab_id, IFNULL(NEW.member_id, 0), "
+            "NEW.result IS 'granted', NEW.result IS NOT 'granted') "
+            "ON CONFLICT (period, lab_id, member_id) DO UPDATE SET "
+            "granted = granted + excluded.granted, denied = denied + excluded.denied; END"
+        )
+        if not exists:
+            # first run on an existing database: count what is already logged
+            cursor.execute(
+                f"INSERT INTO {table} (period, lab_id, member_id, granted, denied) "
+                f"SELECT substr(time_stamp, 1, {width}), lab_id, IFNULL(member_id, 0), "
+                "SUM(result IS 'granted'), SUM(result IS NOT 'granted') FROM LabAccess "
+                f"GROUP BY substr(time_stamp, 1, {width}), lab_id, IFNULL(member_id, 0)"
+            )
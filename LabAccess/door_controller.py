@@ -0,0 +1,264 @@
+"""Runs several doors, each with its own camera and lab, from one process.
+
+Every door has a capture thread that reads into reusable frame buffers and
+keeps only its newest frames in a small bounded queue. Recognition workers serve the doors round-robin, so they all
+share a single detector, embedding model and gallery cache, and a busy door
+can never hold the workers while a quiet door waits.
+
+Example (two doors, camera 0 for Theory and camera 1 for AI):
+
+    python door_controller.py --door front=0:Theory --door back=1:AI
+
+Add ``--processes N`` to run recognition in N worker processes instead of
+threads (see inference_pool.py). The embedding model is then loaded only in
+the workers; this process keeps just the face detector for the governors.
+"""
+import argparse
+import threading
+import time
+from collections import deque
+
+import cv2
+
+import database
+from face_detector import has_face
+from frame_buffer import FramePool
+from idle_governor import IdleGovernor, ACTIVE, IDLE_DELAY_MS
+from inference_pool import InferencePool
+from lab_directory import LabDirectory
+
+QUEUE_SIZE = 2        # frames kept per door; older ones are dropped
+SCAN_INTERVAL = 0.5   # seconds between frames a door submits for recognition
+
+
+class Door:
+    """One camera source bound to one lab."""
+
+    def __init__(self, name, source, lab_id, buffers, queue_size=QUEUE_SIZE):
+        self.name = name
+        self.source = source
+        self.lab_id = lab_id
+        self.buffers = buffers  # FramePool the camera captures into
+        self.frames = deque()
+        self.queue_size = queue_size
+        self.cap = None
+        # a visible face keeps the door active while someone stands still
+        self.governor = IdleGovernor(detect=has_face)
+        self.scans = 0
+        self.granted = 0
+        self.dropped = 0
+        self.failed = 0
+        self.last_result = None
+
+    def open(self) -> bool:
+        self.cap = cv2.VideoCapture(self.source)
+        return self.cap.isOpened()
+
+    def release(self):
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+
+class DoorController:
+    """Schedules recognition for many doors over a shared runtime.
+
+    ``recognize(frame, lab_id)`` returns the same (granted, name) tuple as
+    ``fr.is_face_recognized``; ``on_result(door, result)`` is called from a
+    worker thread after every scan. Doors capture into ``buffers`` when given
+    (e.g. an InferencePool's shared frames), otherwise into a private pool each.
+    """
+
+    def __init__(self, recognize=None, on_result=None, workers=1, scan_interval=SCAN_INTERVAL,
+                 buffers=None):
+        if recognize is None:
+            # imported here: it loads a model replica, which process mode keeps out of this process
+            import facial_recognition as fr
+            recognize = fr.recognize_frame
+        self.recognize = recognize
+        self.on_result = on_result
+        self.workers = workers
+        self.scan_interval = scan_interval
+        self.buffers = buffers
+        self.doors = []
+        self._next_door = 0
+        self._pending = threading.Condition()
+        self._running = False
+        self._threads = []
+
+    def add_door(self, name, source, lab_id) -> Door:
+        # queued frames, one being captured and one per worker being scanned
+        buffers = self.buffers or FramePool(count=QUEUE_SIZE + 1 + self.workers)
+        door = Door(name, source, lab_id, buffers)
+        with self._pending:
+            self.doors.append(door)
+        return door
+
+    def submit(self, door, frame):
+        """Queues a frame for a door, dropping its oldest one when full."""
+        with self._pending:
+            if len(door.frames) == door.queue_size:
+                door.dropped += 1
+                door.frames.popleft().release()
+            door.frames.append(frame)
+            self._pending.notify()
+
+    def start(self):
+        self._running = True
+        for door in self.doors:
+            if not door.open():
+                print(f"[WARN] Could not open camera {door.source!r} for door {door.name}.")
+                continue
+            self._spawn(self._capture_loop, door)
+        for _ in range(self.workers):
+            self._spawn(self._recognition_loop)
+
+    def stop(self):
+        with self._pending:
+            self._running = False
+            self._pending.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        for door in self.doors:
+            while door.frames:
+                door.frames.popleft().release()
+            door.release()
+            times = door.governor.report()
+            print(f"[INFO] Door {door.name}: idle {times['idle']:.0f}s, active {times['active']:.0f}s, "
+                  f"{door.scans} scans, {door.granted} granted, {door.failed} failed, "
+                  f"{door.dropped} frames dropped.")
+
+    # ---------- threads ----------
+
+    def _spawn(self, target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _capture_loop(self, door):
+        last_submit = 0.0
+        while self._running:
+            ret, frame = door.buffers.read(door.cap)
+            if not ret:
+                print(f"[WARN] Failed to grab frame for door {door.name}.")
+                time.sleep(self.scan_interval)
+                continue
+            if frame is None:
+                door.dropped += 1
+                continue
+            if door.governor.observe(frame) != ACTIVE:
+                # nobody at this door: poll slowly and leave the workers to others
+                frame.release()
+                time.sleep(IDLE_DELAY_MS / 1000)
+                continue
+            now = time.monotonic()
+            if now - last_submit >= self.scan_interval:
+                last_submit = now
+                self.submit(door, frame)
+            else:
+                frame.release()
+
+    def _take_next(self):
+        """Pops a frame from the next door in round-robin order."""
+        with self._pending:
+            while self._running:
+                for offset in range(len(self.doors)):
+                    idx = (self._next_door + offset) % len(self.doors)
+                    door = self.doors[idx]
+                    if door.frames:
+                        self._next_door = idx + 1
+                        return door, door.frames.popleft()
+                self._pending.wait()
+            return None, None
+
+    def _recognition_loop(self):
+        while True:
+            door, frame = self._take_next()
+            if door is None:
+                return
+            try:
+                result = self.recognize(frame, door.lab_id)
+            except Exception as exc:
+                # one bad scan must not take this worker away from every door
+                door.failed += 1
+                print(f"[WARN] Recognition failed for door {door.name}: {exc!r}")
+                continue
+            finally:
+                frame.release()
+            door.scans += 1
+            door.granted += int(bool(result[0]))
+            door.last_result = result
+            if self.on_result is not None:
+                self.on_result(door, result)
+
+
+def parse_door(spec):
+    """Parses NAME=SOURCE:LAB, where SOURCE is a camera index or a URL/path."""
+    name, _, rest = spec.partition("=")
+    source, _, lab = rest.rpartition(":")
+    if not (name and source and lab):
+        raise argparse.ArgumentTypeError(f"expected NAME=SOURCE:LAB, got {spec!r}")
+    return name, int(source) if source.isdigit() else source, lab
+
+
+def print_result(door, result):
+    granted, name = result
+    status = f"granted to {name}" if granted else "denied"
+    print(f"[INFO] Door {door.name} (lab {door.lab_id}): access {status}.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--door", type=parse_door, action="append", required=True,
+                        help="NAME=SOURCE:LAB, may be given several times")
+    parser.add_argument("--workers", type=int, default=1, help="recognition threads")
+    parser.add_argument("--interval", type=float, default=SCAN_INTERVAL,
+                        help="seconds between scans per door")
+    parser.add_argument("--processes", type=int, default=0,
+                        help="run recognition in this many worker processes")
+    args = parser.parse_args()
+
+    labs = LabDirectory(database.DB_PATH)
+    labs.load()
+    pool = None
+    if args.processes > 0:
+        # doors capture straight into the workers' shared memory
+        slots = len(args.door) * (QUEUE_SIZE + 1) + args.processes
+        pool = InferencePool(args.processes, slots=slots)
+    else:
+        import facial_recognition as fr
+        # shadow scoring only sees scans recognised in this process
+        fr.start_shadow()
+    controller = DoorController(
+        recognize=pool.recognize if pool else None,
+        on_result=print_result,
+        # keep every replica busy: one scheduling thread per process
+        workers=max(args.workers, args.processes),
+        scan_interval=args.interval,
+        buffers=pool.frames if pool else None,
+    )
+    for name, source, lab_name in args.door:
+        lab = labs.find(lab_name)
+        if lab is None:
+            parser.error(f"unknown lab {lab_name!r}")
+        controller.add_door(name, source, lab.lab_id)
+
+    controller.start()
+    try:
+        while pool is None or pool.healthy:
+            time.sleep(1)
+        print("[WARN] Recognition workers keep crashing; stopping the doors.")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        controller.stop()
+        if pool is not None:
+            pool.close()
+        else:
+            fr.close()
+        labs.close()
+
+
+if __name__ == "__main__":
+    main()
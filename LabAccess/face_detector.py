@@ -0,0 +1,43 @@
+"""The shared MediaPipe face detector, without the embedding model.
+
+facial_recognition detects faces through this module. Processes that only
+need to know whether someone is in view (door_controller's parent process in
+``--processes`` mode) import it alone, so they do not load a model replica.
+"""
+import threading
+
+import mediapipe as mp
+from mediapipe.tasks import python
+from mediapipe.tasks.python import vision
+
+from frame_buffer import Frame, copies
+
+_detector = None
+_detector_lock = threading.Lock()
+
+
+def detect_faces(image):
+    """Runs the shared MediaPipe face detector on an mp.Image.
+
+    The detector is created once per process and reused by every caller; calls
+    are serialized because a MediaPipe task instance is not thread-safe.
+    """
+    global _detector
+    with _detector_lock:
+        if _detector is None:
+            base_options = python.BaseOptions(model_asset_path="detector.tflite")
+            options = vision.FaceDetectorOptions(base_options=base_options)
+            _detector = vision.FaceDetector.create_from_options(options)
+        return _detector.detect(image)
+
+
+def to_mp_image(frame):
+    """Wraps a Frame or BGR array for MediaPipe, which keeps its own copy."""
+    data = frame.view if isinstance(frame, Frame) else frame
+    copies.record("mp.Image", data.nbytes)
+    return mp.Image(image_format=mp.ImageFormat.SRGB, data=data)
+
+
+def has_face(frame) -> bool:
+    """Cheap presence check used to keep an idle camera awake."""
+    return bool(detect_faces(to_mp_image(frame)).detections)
@@ -0,0 +1,150 @@
+"""Content-addressed on-disk store for enrollment face images.
+
+Images are saved once under their SHA-256 hash (``face_store/faces/ab/abcdef….jpg``)
+and LabMember keeps only that hash in ``face_ref``, so the hot table stays
+small and identical photos are stored once. Small JPEG thumbnails for the
+admin panel are made on first use and kept next to the originals.
+
+Rows enrolled before the store existed still carry their image inline in
+``facial_id``; ``load_member_image`` reads either form, and
+
+    python face_store.py migrate --vacuum
+
+moves those images into the store and shrinks the database file.
+"""
+import argparse
+import hashlib
+import os
+import tempfile
+from io import BytesIO
+
+import database
+
+STORE_DIR = "face_store"
+THUMB_SIZE = (48, 48)
+
+
+class FaceStore:
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+
+    def path(self, ref, kind="faces"):
+        return os.path.join(self.root, kind, ref[:2], ref + ".jpg")
+
+    def put(self, data) -> str:
+        """Stores image bytes and returns their reference; duplicates are free."""
+        ref = hashlib.sha256(data).hexdigest()
+        path = self.path(ref)
+        if not os.path.exists(path):
+            self._write(path, data)
+        return ref
+
+    def get(self, ref):
+        try:
+            with open(self.path(ref), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def thumbnail(self, ref):
+        """Returns JPEG bytes of a THUMB_SIZE thumbnail, or None if the image is gone."""
+        path = self.path(ref, "thumbs")
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            pass
+        data = self.get(ref)
+        if data is None:
+            return None
+        from PIL import Image
+
+        image = Image.open(BytesIO(data))
+        image.thumbnail(THUMB_SIZE)
+        buffer = BytesIO()
+        image.convert("RGB").save(buffer, format="JPEG", quality=80)
+        thumb = buffer.getvalue()
+        self._write(path, thumb)
+        return thumb
+
+    def refs(self):
+        faces = os.path.join(self.root, "faces")
+        for dirpath, _, filenames in os.walk(faces):
+            for name in filenames:
+                if name.endswith(".jpg"):
+                    yield name[:-4]
+
+    def remove(self, ref):
+        for kind in ("faces", "thumbs"):
+            try:
+                os.remove(self.path(ref, kind))
+            except FileNotFoundError:
+                pass
+
+    def _write(self, path, data):
+        # write to a temp file first so readers never see a partial image
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+
+store = FaceStore()
+
+
+def load_member_image(conn, member_id, face_ref, face_store=None):
+    """Returns a member's enrollment image from the store or the legacy column."""
+    if face_ref:
+        return (face_store or store).get(face_ref)
+    row = conn.execute("SELECT facial_id FROM LabMember WHERE member_id = ?", (member_id,)).fetchone()
+    return row[0] if row else None
+
+
+def migrate(conn, face_store=None, vacuum=False):
+    """Moves inline facial_id images into the store; returns rows moved."""
+    face_store = face_store or store
+    moved = 0
+    rows = conn.execute("SELECT member_id FROM LabMember WHERE facial_id IS NOT NULL AND face_ref IS NULL").fetchall()
+    for (member_id,) in rows:
+        (data,) = conn.execute("SELECT facial_id FROM LabMember WHERE member_id = ?", (member_id,)).fetchone()
+        ref = face_store.put(data)
+        conn.execute("UPDATE LabMember SET face_ref = ?, facial_id = NULL WHERE member_id = ?", (ref, member_id))
+        conn.commit()
+        moved += 1
+    if vacuum:
+        conn.execute("VACUUM")
+    return moved
+
+
+def collect_garbage(conn, face_store=None):
+    """Deletes stored images no LabMember row refers to; returns how many."""
+    face_store = face_store or store
+    used = {row[0] for row in conn.execute("SELECT face_ref FROM LabMember WHERE face_ref IS NOT NULL")}
+    removed = 0
+    for ref in list(face_store.refs()):
+        if ref not in used:
+            face_store.remove(ref)
+            removed += 1
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the enrollment image store.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    migrate_cmd = sub.add_parser("migrate", help="move inline facial_id images into the store")
+    migrate_cmd.add_argument("--vacuum", action="store_true", help="compact the database afterwards")
+    sub.add_parser("gc", help="delete images no member refers to")
+    args = parser.parse_args()
+
+    conn = database.connect()
+    database.ensure_schema(conn)
+    if args.command == "migrate":
+        print(f"[INFO] Moved {migrate(conn, vacuum=args.vacuum)} images into {store.root}.")
+    else:
+        print(f"[INFO] Removed {collect_garbage(conn)} unused images.")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,25 +3,65 @@ import math
 import cv2
 import numpy as np
 from PIL import Image
-import mediapipe as mp
-from mediapipe.tasks import python
-from mediapipe.tasks.python import vision
 from facenet_pytorch import MTCNN, InceptionResnetV1
 import torch
 from torchvision import transforms
-import sqlite3
 from io import BytesIO
+import time
+
+from frame_buffer import copies
+from face_detector import detect_faces, has_face, to_mp_image
+from gallery_cache import GalleryCache
+from database import DB_PATH
+import access_log
+import config
+import template_codecs
 
 MARGIN = 10  # pixels
 ROW_SIZE = 10  # pixels
 FONT_SIZE = 1
 FONT_THICKNESS = 1
 TEXT_COLOR = (255, 0, 0)  # red
+MATCH_THRESHOLD = config.load()['match_threshold']  # max embedding distance accepted as the same person; see calibrate.py
+TEMPLATE_FORMAT = 'float32'  # storage format for new templates, see template_codecs
+
+# two-stage cascade: a downscaled first pass decides clear cases on its own
+CASCADE_ENABLED = False
+FAST_SIZE = 112  # first-stage input size (full model uses 160)
+CASCADE_ACCEPT_MARGIN = 0.15  # fast distance this far below the threshold accepts
+CASCADE_REJECT_MARGIN = 0.25  # fast distance this far above the threshold rejects
+
+# embedding models by name; stored templates belong to MODEL_NAME (see reembed.py)
+MODELS = {
+    'vggface2': lambda: InceptionResnetV1(pretrained='vggface2'),
+    'casia-webface': lambda: InceptionResnetV1(pretrained='casia-webface'),
+}
+MODEL_NAME = config.load()['model']
+
+def fast_model_name(model_name):
+    """LabMemberTemplate key of the cascade's first-stage templates for a model."""
+    return f'{model_name}@{FAST_SIZE}'
+
+FAST_MODEL = fast_model_name(MODEL_NAME)
+
+def load_model(name):
+    if name not in MODELS:
+      raise ValueError(f"unknown embedding model {name!r}; choose from {', '.join(MODELS)}")
+    return MODELS[name]().eval()
 
-resnet = InceptionResnetV1(pretrained='vggface2').eval()
+resnet = load_model(MODEL_NAME)
 
+# every crop becomes the same square, so any set of faces stacks into one batch
 preprocess = transforms.Compose([
     transforms.Resize(160),
+    transforms.CenterCrop(160),
+    transforms.ToTensor(),
+    transforms.Normalize(mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5])
+])
+
+fast_preprocess = transforms.Compose([
+    transforms.Resize(FAST_SIZE),
+    transforms.CenterCrop(FAST_SIZE),
     transforms.ToTensor(),
     transforms.Normalize(mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5])
 ])
@@ -56,7 +96,7 @@ def visualize(
   Returns:
     Image with bounding boxes.
   """
-  annotated_image = image.copy()
+  annotated_image = copies.copy(image, 'visualize')
   height, width, _ = image.shape
 
   for detection in detection_result.detections:
@@ -87,8 +127,7 @@ def visualize(
   return annotated_image
 
 def get_largest_bounding_box(image,detection_result):
-  annotated_image = image.copy()
-
+  """Returns a view of the largest detected face; the image is not copied."""
   largest_box = None
   largest_area = -1
 
@@ -103,25 +142,18 @@ def get_largest_bounding_box(image,detection_result):
   if not largest_box:
     return
 
-  annotated_image = annotated_image[largest_box.origin_y:(largest_box.origin_y + largest_box.height),
-                                    largest_box.origin_x:(largest_box.origin_x + largest_box.width)]
-  return annotated_image
+  return image[largest_box.origin_y:(largest_box.origin_y + largest_box.height),
+               largest_box.origin_x:(largest_box.origin_x + largest_box.width)]
 
 def register_face(image):
-    base_options = python.BaseOptions(model_asset_path='detector.tflite')
-    options = vision.FaceDetectorOptions(base_options=base_options)
-    detector = vision.FaceDetector.create_from_options(options)
-
-    detection_result = detector.detect(image)
-
-    image_copy = np.copy(image.numpy_view())
+    detection_result = detect_faces(image)
 
-    annotated_image = visualize(image_copy, detection_result)
-    main_face = get_largest_bounding_box(image_copy, detection_result)
+    # read-only view; visualize() copies it itself when debugging needs it
+    image_view = image.numpy_view()
+    main_face = get_largest_bounding_box(image_view, detection_result)
 
-    # cv2.imwrite("image.jpg", image_copy)
     # cv2.imwrite("main.jpg", main_face)
-    # cv2.imwrite("annotated.jpg", annotated_image)
+    # cv2.imwrite("annotated.jpg", visualize(image_view, detection_result))
 
     rgb_main_face = cv2.cvtColor(main_face, cv2.COLOR_BGR2RGB)
 
@@ -138,59 +170,167 @@ def register_face(image):
 
     return buffer
 
+def decode_face(blob):
+    """Decodes a stored facial_id JPEG blob back into a BGR face crop."""
+    nparr = np.frombuffer(blob, np.uint8)
+    return cv2.imdecode(nparr, cv2.COLOR_BGR2RGB)
+
+def embed_face(face, transform=preprocess, model=None) -> np.ndarray:
+    """Returns the 512-d embedding of a BGR face crop (by default with resnet)."""
+    rgb_face = cv2.cvtColor(face, cv2.COLOR_BGR2RGB)
+    tensor = transform(Image.fromarray(rgb_face)).unsqueeze(0)
+
+    with torch.no_grad():
+      embedding = (model or resnet)(tensor)
+
+    return embedding[0].numpy()
+
+def embed_faces(faces, transform=preprocess, model=None) -> np.ndarray:
+    """Embeds a list of BGR face crops in one forward pass; returns (n, 512).
+
+    The transform crops every face to the same square, so the batch gives the
+    same embeddings as calling embed_face on each crop.
+    """
+    if not faces:
+      return np.empty((0, 512), dtype=np.float32)
+    batch = torch.stack([transform(Image.fromarray(cv2.cvtColor(face, cv2.COLOR_BGR2RGB))) for face in faces])
+    with torch.no_grad():
+      return (model or resnet)(batch).numpy()
+
+def embed_blob(blob):
+    face = decode_face(blob)
+    if face is None:
+      return None
+    return embed_face(face)
+
+def encode_template(embedding):
+    """Encodes an embedding in TEMPLATE_FORMAT for LabMember.face_template."""
+    fmt = TEMPLATE_FORMAT
+    codebook = None
+    if fmt == 'pq':
+      codebook = gallery.latest_codebook()
+      if codebook is None:
+        fmt = 'float16'  # no codebook trained yet
+    return template_codecs.encode_template(embedding, fmt, codebook)
+
+def make_template(blob):
+    embedding = embed_blob(blob)
+    if embedding is None:
+      return None
+    return encode_template(embedding)
+
+def make_fast_template(blob):
+    face = decode_face(blob)
+    if face is None:
+      return None
+    return template_codecs.encode_template(embed_face(face, fast_preprocess))
+
+# enrolled templates, loaded once per lab and kept up to date by main.py
+gallery = GalleryCache(DB_PATH, make_template, model=MODEL_NAME)
+# first-stage templates for the cascade: built once from the enrollment images
+# (or ahead of time by reembed.py run --fast) and replicated to kiosks
+fast_gallery = GalleryCache(DB_PATH, make_fast_template, model=FAST_MODEL, store_built=True)
+
+# how many scans each cascade stage decided
+stage_counts = {'fast': 0, 'full': 0}
+
+# candidate model scored in the background on live scans, see shadow_model.py
+shadow = None
+SHADOW_MODEL = config.load().get('shadow_model')
+
+def start_shadow(model_name=SHADOW_MODEL):
+    global shadow
+    if model_name and shadow is None:
+      from shadow_model import ShadowScorer
+      shadow = ShadowScorer(model_name)
+    return shadow
+
+def member_changed(member_id):
+    """Tells every gallery that a LabMember row was inserted or edited."""
+    gallery.member_changed(member_id)
+    fast_gallery.member_changed(member_id)
+
+def close():
+    global shadow
+    if shadow is not None:
+      shadow.close()
+      shadow.print_report()
+      shadow = None
+    gallery.close()
+    fast_gallery.close()
+
+def match_face(main_face, lab_id, cascade=None):
+    """Matches a BGR face crop against a lab.
+
+    Returns (granted, name, stage, member_id); name and member_id are None
+    when access is denied.
+
+    Both stages grant the nearest member. With the cascade on, the
+    downscaled first stage answers alone when its nearest distance is
+    clearly inside or outside MATCH_THRESHOLD; only the ambiguous band in
+    between pays for the full-size embedding. Fast templates are stored in
+    LabMemberTemplate under FAST_MODEL; while any member still lacks one
+    (e.g. on a kiosk before ``reembed.py run --fast`` on the central node)
+    the two galleries differ and every scan goes to the full stage.
+    """
+    if cascade is None:
+      cascade = CASCADE_ENABLED
+
+    member_ids, names, matrix = gallery.lab_embeddings(lab_id)
+    if not member_ids:
+      return (False, None, 'full', None)
+
+    if cascade:
+      fast_ids, fast_names, fast_matrix = fast_gallery.lab_embeddings(lab_id)
+      # both are ordered by member_id; decide early only like-for-like
+      if fast_ids == member_ids:
+        distances = fast_matrix.distances(embed_face(main_face, fast_preprocess))
+        best = int(distances.argmin())
+        if distances[best] < MATCH_THRESHOLD - CASCADE_ACCEPT_MARGIN:
+          return (True, fast_names[best], 'fast', fast_ids[best])
+        if distances[best] > MATCH_THRESHOLD + CASCADE_REJECT_MARGIN:
+          return (False, None, 'fast', None)
+
+    distances = matrix.distances(embed_face(main_face))
+    best = int(distances.argmin())
+    if distances[best] < MATCH_THRESHOLD:
+      return (True, names[best], 'full', member_ids[best])
+
+    return (False, None, 'full', None)
+
+def closest_member(embedding, lab_id):
+    """Returns (member_id, name, distance) of the lab's nearest enrolled face, or None."""
+    member_ids, names, matrix = gallery.lab_embeddings(lab_id)
+    if not member_ids:
+      return None
+    distances = matrix.distances(embedding)
+    best = int(distances.argmin())
+    return (member_ids[best], names[best], float(distances[best]))
+
+def find_main_face(image):
+    """Returns a view of the largest face in an mp.Image, or None."""
+    return get_largest_bounding_box(image.numpy_view(), detect_faces(image))
+
 def is_face_recognized(image, lab_id=-1) -> bool:
     print('run')
-    base_options = python.BaseOptions(model_asset_path='detector.tflite')
-    options = vision.FaceDetectorOptions(base_options=base_options)
-    detector = vision.FaceDetector.create_from_options(options)
-
-    detection_result = detector.detect(image)
-
-    image_copy = np.copy(image.numpy_view())
-
-    annotated_image = visualize(image_copy, detection_result)
-    main_face = get_largest_bounding_box(image_copy, detection_result)
-  
-    conn = sqlite3.connect('thedatabase.db')
-  
-    curr = conn.cursor()
-
-    curr.execute('''SELECT first_name, facial_id, lab_id FROM LABMEMBER''')
-  
-    output = curr.fetchall()
-    for row in output:
-      if row[2] == lab_id:
-        if not row[1] == None:
-          nparr = np.frombuffer(row[1], np.uint8)
-          test_face = cv2.imdecode(nparr, cv2.COLOR_BGR2RGB)
-          # rgb_test_face = cv2.cvtColor(test_face, cv2.COLOR_BGR2RGB)
-
-          # tensor = torch.from_numpy(np.frombuffer(test_face, dtype=np.float32))
-
-          # cv2.imwrite("image.jpg", image_copy)
-          # cv2.imwrite("main.jpg", main_face)
-          # cv2.imwrite("annotated.jpg", annotated_image)
-
-          rgb_main_face = cv2.cvtColor(main_face, cv2.COLOR_BGR2RGB)
-          rgb_test_face = cv2.cvtColor(test_face, cv2.COLOR_BGR2RGB)
-
-          rgb_main_face_image = Image.fromarray(rgb_main_face)
-          test_face_image = Image.fromarray(rgb_test_face)
-
-          rgb_tensor = preprocess(rgb_main_face_image).unsqueeze(0)
-          test_tensor = preprocess(test_face_image).unsqueeze(0)
-
-          with torch.no_grad():
-            embedding_1 = resnet(rgb_tensor)
-            embedding_2 = resnet(test_tensor)
-
-          distance = (embedding_1 - embedding_2).norm().item()
-          print(distance < 0.6)
-          if distance < 0.6:
-            conn.commit()
-            conn.close()
-            return (True, row[0])
-    conn.commit()
-    conn.close()
-
-    return (False, None)
\ No newline at end of file
+    main_face = find_main_face(image)
+    if main_face is None:
+      return (False, None)
+
+    start = time.perf_counter()
+    granted, name, stage, member_id = match_face(main_face, lab_id)
+    elapsed = time.perf_counter() - start
+    stage_counts[stage] += 1
+    if shadow is not None:
+      shadow.submit(main_face, lab_id, member_id, elapsed)
+    print(granted, f'({stage} stage)')
+    access_log.log_scan(lab_id, member_id, granted)
+    return (granted, name)
+
+def recognize_frame(frame, lab_id):
+    """Runs is_face_recognized on a captured frame and reports bytes copied."""
+    copies.start_scan(frame)
+    result = is_face_recognized(to_mp_image(frame), lab_id)
+    total, stages = copies.scan_report()
+    print(f'[INFO] Scan copied {total} bytes {stages}')
+    return result
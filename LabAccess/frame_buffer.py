@@ -0,0 +1,183 @@
+"""Preallocated frame buffers and copy accounting for the scan pipeline.
+
+Captured frames are read straight into slots of a FramePool (optionally backed
+by shared memory, so worker processes can map the same bytes) and handed
+around as read-only Frame handles. Stages that only look at a frame use
+``frame.view`` or a crop of it; a stage that must mutate pixels takes its own
+copy through ``copies.copy()``, which records the bytes copied for the scan
+currently running on that thread.
+"""
+import itertools
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+MAX_FRAME_BYTES = 1920 * 1080 * 3  # largest frame a slot can hold
+
+
+class CopyCounter:
+    """Counts bytes copied per scan, separately for each thread."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def start_scan(self, frame=None):
+        """Starts a new tally, seeded with the bytes it took to capture frame."""
+        self._local.stages = {}
+        if isinstance(frame, Frame) and frame.copied_bytes:
+            self._local.stages["capture"] = frame.copied_bytes
+
+    def record(self, stage, nbytes):
+        stages = getattr(self._local, "stages", None)
+        if stages is not None:
+            stages[stage] = stages.get(stage, 0) + nbytes
+
+    def copy(self, array, stage):
+        """Returns a writable copy of array and records its size."""
+        self.record(stage, array.nbytes)
+        return array.copy()
+
+    def scan_report(self):
+        """Returns (total_bytes, {stage: bytes}) for the current scan."""
+        stages = dict(getattr(self._local, "stages", {}))
+        return sum(stages.values()), stages
+
+
+copies = CopyCounter()
+
+
+class Frame:
+    """Reference-counted handle to one slot of a FramePool."""
+
+    def __init__(self, pool, slot, shape, copied_bytes=0):
+        self.pool = pool
+        self.slot = slot
+        self.shape = shape
+        self.seq = next(pool._seq)  # increases with every frame the pool hands out
+        self.captured = time.monotonic()
+        self.copied_bytes = copied_bytes
+        self._refs = 1
+        self.view = pool._view(slot, shape)
+        self.view.flags.writeable = False
+
+    @property
+    def nbytes(self):
+        return self.view.nbytes
+
+    @property
+    def shm_name(self):
+        """Shared-memory block name, or None for a private pool."""
+        return self.pool.slot_names()[self.slot] if self.pool.shared else None
+
+    def crop(self, top, bottom, left, right):
+        return self.view[top:bottom, left:right]
+
+    def retain(self):
+        with self.pool._cond:
+            self._refs += 1
+        return self
+
+    def release(self):
+        with self.pool._cond:
+            self._refs -= 1
+            if self._refs == 0:
+                self.view = None
+                self.pool._free.append(self.slot)
+                self.pool._cond.notify()
+
+
+class FramePool:
+    """A fixed set of frame-sized buffers that are reused instead of reallocated."""
+
+    def __init__(self, max_bytes=MAX_FRAME_BYTES, count=4, shared=False):
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self.shape = None  # last captured frame shape
+        if shared:
+            self._blocks = [shared_memory.SharedMemory(create=True, size=max_bytes) for _ in range(count)]
+            self._buffers = [block.buf for block in self._blocks]
+        else:
+            self._blocks = []
+            self._buffers = [bytearray(max_bytes) for _ in range(count)]
+        self._free = list(range(count))
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+
+    def slot_names(self):
+        return [block.name for block in self._blocks]
+
+    def acquire(self, block=True):
+        """Returns a free slot index, or None when block is False and none is free."""
+        with self._cond:
+            while not self._free:
+                if not block:
+                    return None
+                self._cond.wait()
+            return self._free.pop()
+
+    def read(self, cap):
+        """Reads the next camera frame directly into a free slot.
+
+        Returns (ret, frame); frame is None when the read failed or every slot
+        is still held downstream (the frame is then dropped, not queued). A
+        frame too large for a slot is stored downscaled to fit.
+        """
+        slot = self.acquire(block=False)
+        if slot is None:
+            ret, _ = cap.read()
+            return ret, None
+        target = self._view(slot, self.shape) if self.shape is not None else None
+        ret, image = cap.read(target) if target is not None else cap.read()
+        if not ret or image is None:
+            self._release_slot(slot)
+            return False, None
+        if image.nbytes > self.max_bytes:
+            image = self._fit(image)
+        copied = 0
+        if target is None or image.shape != self.shape or not np.shares_memory(image, target):
+            # first frame, or the camera changed resolution: fall back to one copy
+            self.shape = image.shape
+            self._view(slot, image.shape)[...] = image
+            copied = image.nbytes
+        return True, Frame(self, slot, image.shape, copied)
+
+    def write(self, array, block=True):
+        """Copies an existing array into a slot and returns its Frame."""
+        array = np.ascontiguousarray(array, dtype=np.uint8)
+        if array.nbytes > self.max_bytes:
+            raise ValueError(f"frame of {array.nbytes} bytes exceeds slot size {self.max_bytes}")
+        slot = self.acquire(block)
+        if slot is None:
+            return None
+        self._view(slot, array.shape)[...] = array
+        return Frame(self, slot, array.shape, array.nbytes)
+
+    def close(self):
+        self._buffers = []
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+    def _view(self, slot, shape):
+        nbytes = int(np.prod(shape))
+        if nbytes > self.max_bytes:
+            raise ValueError(f"frame of {nbytes} bytes exceeds slot size {self.max_bytes}")
+        return np.ndarray(shape, dtype=np.uint8, buffer=self._buffers[slot])
+
+    def _fit(self, image):
+        """Every step-th row and column of image, small enough for a slot."""
+        step = 2
+        while -(-image.shape[0] // step) * -(-image.shape[1] // step) * image[0, 0].size > self.max_bytes:
+            step += 1
+        if self.shape is None or self.shape[:2] != (-(-image.shape[0] // step), -(-image.shape[1] // step)):
+            print(f"[WARN] Camera frame {image.shape[1]}x{image.shape[0]} exceeds the frame buffers; "
+                  f"storing it downscaled by {step}.")
+        return image[::step, ::step]
+
+    def _release_slot(self, slot):
+        with self._cond:
+            self._free.append(slot)
+            self._cond.notify()
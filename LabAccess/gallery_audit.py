@@ -0,0 +1,165 @@
+"""Finds duplicate enrollments and colliding identities in the gallery.
+
+Every pair of enrolled templates is compared, a block of BLOCK_ROWS x
+BLOCK_ROWS at a time, so memory stays at a few tens of MB while the work is
+plain matrix products. Pairs closer than MATCH_THRESHOLD would be accepted
+as each other at the door; the report sorts them into
+
+    duplicate   closer than DUPLICATE_DISTANCE: almost surely one person enrolled twice
+    collision   under MATCH_THRESHOLD: a scan of one can grant as the other
+    near        within NEAR_MARGIN above the threshold: one bad photo away
+
+Pairs in the same lab matter most, since scans are matched per lab.
+
+    python gallery_audit.py                       # whole database
+    python gallery_audit.py --lab Theory
+    python gallery_audit.py --building EIEAB --csv audit.csv
+"""
+import argparse
+import csv
+import time
+
+import numpy as np
+
+import database
+import template_codecs
+from face_store import load_member_image
+
+BLOCK_ROWS = 2048
+DUPLICATE_DISTANCE = 0.3
+NEAR_MARGIN = 0.1
+
+
+def load_gallery(conn, lab_id=None, building=None):
+    """Returns (members, vectors): member rows and a float32 (n, 512) matrix."""
+    sql = ("SELECT m.member_id, m.first_name, m.last_name, m.lab_id, m.face_template, m.face_ref "
+           "FROM LabMember m LEFT JOIN Lab l ON l.lab_id = m.lab_id")
+    clauses, params = [], []
+    if lab_id is not None:
+        clauses.append("m.lab_id = ?")
+        params.append(lab_id)
+    if building is not None:
+        clauses.append("l.building = ?")
+        params.append(building)
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+
+    codebooks = template_codecs.load_codebooks(conn)
+    members, vectors = [], []
+    fr = None
+    for member_id, first, last, member_lab, template, face_ref in conn.execute(sql, params).fetchall():
+        vector = template_codecs.decode_template(template, codebooks) if template else None
+        if vector is None:
+            # no stored template yet: embed the enrollment image
+            image = load_member_image(conn, member_id, face_ref)
+            if image is not None:
+                if fr is None:
+                    import facial_recognition as fr
+                vector = fr.embed_blob(image)
+        if vector is None:
+            print(f"[WARN] Member {member_id} has no usable face; skipped.")
+            continue
+        members.append((member_id, f"{first} {last}", member_lab))
+        vectors.append(vector)
+    return members, np.asarray(vectors, dtype=np.float32).reshape(-1, template_codecs.EMBEDDING_SIZE)
+
+
+def close_pairs(vectors, limit, block=BLOCK_ROWS):
+    """Yields (i, j, distance) for every i < j closer than limit."""
+    norms = np.einsum("ij,ij->i", vectors, vectors)
+    limit_sq = limit * limit
+    n = len(vectors)
+    for i0 in range(0, n, block):
+        a = vectors[i0:i0 + block]
+        for j0 in range(i0, n, block):
+            b = vectors[j0:j0 + block]
+            sq = norms[i0:i0 + block, None] + norms[None, j0:j0 + block] - 2.0 * (a @ b.T)
+            if i0 == j0:
+                # each pair once, never a template with itself
+                sq[np.tril_indices(len(a), 0, len(b))] = np.inf
+            rows, cols = np.nonzero(sq < limit_sq)
+            for r, c in zip(rows, cols):
+                yield i0 + r, j0 + c, float(np.sqrt(max(sq[r, c], 0.0)))
+
+
+def classify(distance, threshold):
+    if distance < DUPLICATE_DISTANCE:
+        return "duplicate"
+    if distance < threshold:
+        return "collision"
+    return "near"
+
+
+def audit(members, vectors, threshold):
+    """Returns finding dicts sorted by distance, closest first."""
+    findings = []
+    for i, j, distance in close_pairs(vectors, threshold + NEAR_MARGIN):
+        (id_a, name_a, lab_a), (id_b, name_b, lab_b) = members[i], members[j]
+        findings.append({
+            "kind": classify(distance, threshold),
+            "distance": distance,
+            "same_lab": lab_a == lab_b,
+            "member_a": id_a, "name_a": name_a, "lab_a": lab_a,
+            "member_b": id_b, "name_b": name_b, "lab_b": lab_b,
+        })
+    findings.sort(key=lambda f: f["distance"])
+    return findings
+
+
+def print_audit(findings, count, elapsed):
+    pairs = count * (count - 1) // 2
+    print(f"Compared {count} templates ({pairs} pairs) in {elapsed:.1f} s.")
+    for kind in ("duplicate", "collision", "near"):
+        found = [f for f in findings if f["kind"] == kind]
+        same = sum(f["same_lab"] for f in found)
+        print(f"{kind + ':':<11} {len(found):6d} ({same} within one lab)")
+    for f in findings:
+        if f["kind"] == "near" and not f["same_lab"]:
+            continue
+        where = f"lab {f['lab_a']}" if f["same_lab"] else f"labs {f['lab_a']}/{f['lab_b']}"
+        print(f"  {f['kind']:<9} {f['distance']:.3f}  #{f['member_a']} {f['name_a']}  <->  "
+              f"#{f['member_b']} {f['name_b']}  ({where})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report duplicate and colliding enrollments.")
+    parser.add_argument("--lab", help="only this lab (by name)")
+    parser.add_argument("--building", help="only labs in this building")
+    parser.add_argument("--threshold", type=float, help="match threshold (default: facial_recognition's)")
+    parser.add_argument("--csv", help="also write every finding to this file")
+    args = parser.parse_args()
+
+    conn = database.connect()
+    database.ensure_schema(conn)
+    lab_id = None
+    if args.lab:
+        from lab_directory import LabDirectory
+        labs = LabDirectory(database.DB_PATH)
+        labs.load()
+        lab = labs.find(args.lab)
+        labs.close()
+        if lab is None:
+            parser.error(f"unknown lab {args.lab!r}")
+        lab_id = lab.lab_id
+    threshold = args.threshold
+    if threshold is None:
+        import facial_recognition as fr
+        threshold = fr.MATCH_THRESHOLD
+
+    members, vectors = load_gallery(conn, lab_id, args.building)
+    conn.close()
+    start = time.perf_counter()
+    findings = audit(members, vectors, threshold)
+    print_audit(findings, len(members), time.perf_counter() - start)
+
+    if args.csv:
+        with open(args.csv, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=["kind", "distance", "same_lab", "member_a", "name_a", "lab_a",
+                                                   "member_b", "name_b", "lab_b"])
+            writer.writeheader()
+            writer.writerows(findings)
+        print(f"[INFO] Wrote {len(findings)} findings to {args.csv}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""In-process cache of enrolled face embeddings, keyed by lab_id.
+
+Each lab's gallery is loaded from SQLite the first time it is scanned and is
+then kept in memory, so recognition only has to embed the live face. Members
+are held as encoded templates (see template_codecs.py); a member without a
+stored template is embedded from their enrollment image once, on load; the
+image itself is only read then, never on a normal scan. The
+admin panel notifies the cache when it inserts or edits a member, and changes
+made by other processes are picked up through the trigger-maintained
+CatalogVersion counter, re-embedding only the rows whose image actually
+changed. Logged scans do not bump it, so they never cause a resync.
+"""
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import database
+from face_store import load_member_image
+from template_codecs import TemplateMatrix, load_codebooks
+
+DEFAULT_CAPACITY = 8  # labs kept in memory before the coldest is evicted
+
+
+def _digest(blob) -> bytes:
+    return hashlib.blake2b(blob, digest_size=16).digest()
+
+
+class LabGallery:
+    """Embeddings for the members of a single lab."""
+
+    def __init__(self):
+        self.members = {}  # member_id -> (first_name, digest, template)
+        self._snapshot = None
+
+    def put(self, member_id, first_name, digest, template):
+        self.members[member_id] = (first_name, digest, template)
+        self._snapshot = None
+
+    def remove(self, member_id) -> bool:
+        if self.members.pop(member_id, None) is None:
+            return False
+        self._snapshot = None
+        return True
+
+    def snapshot(self, codebooks):
+        """Returns (member_ids, names, TemplateMatrix) ordered by member_id."""
+        if self._snapshot is None:
+            ids = sorted(self.members)
+            names = [self.members[i][0] for i in ids]
+            matrix = TemplateMatrix([self.members[i][2] for i in ids], codebooks)
+            self._snapshot = (ids, names, matrix)
+        return self._snapshot
+
+
+class GalleryCache:
+    """LRU cache of per-lab galleries with incremental invalidation.
+
+    ``make_template`` turns an enrollment image blob into an encoded
+    template, or returns None when the image does not contain a usable face.
+    With ``use_stored_templates=False`` the face_template column is ignored
+    and every member is built from their image (e.g. for another model).
+    With ``model`` set, only templates made by that model are used: a
+    LabMember.face_template tagged with another template_model is replaced
+    by the member's row for the model in LabMemberTemplate, if any. With
+    ``store_built`` as well, templates built from images are saved there
+    under ``model``, so each is built once and replicated to kiosks.
+    """
+
+    def __init__(self, db_path, make_template, capacity=DEFAULT_CAPACITY, use_stored_templates=True, model=None,
+                 store_built=False):
+        self.db_path = db_path
+        self.make_template = make_template
+        self.capacity = capacity
+        self.use_stored_templates = use_stored_templates
+        self.model = model
+        self.store_built = store_built and model is not None
+        self.codebooks = None
+        self._labs = OrderedDict()  # lab_id -> LabGallery
+        self._lock = threading.RLock()
+        self._conn = None
+        self._data_version = None
+        self._catalog_version = None
+
+    # ---------- lookups ----------
+
+    def lab_embeddings(self, lab_id):
+        """Returns (member_ids, names, TemplateMatrix) for every enrolled lab member."""
+        with self._lock:
+            self._check_data_version()
+            gallery = self._labs.get(lab_id)
+            if gallery is None:
+                gallery = self._load_lab(lab_id)
+                self._labs[lab_id] = gallery
+                while len(self._labs) > self.capacity:
+                    self._labs.popitem(last=False)
+            self._labs.move_to_end(lab_id)
+            return gallery.snapshot(self.codebooks)
+
+    def latest_codebook(self):
+        """Newest product-quantization codebook, or None if none was trained."""
+        with self._lock:
+            self._check_data_version()
+            return self.codebooks[max(self.codebooks)] if self.codebooks else None
+
+    # ---------- invalidation hooks ----------
+
+    def member_changed(self, member_id):
+        """Re-reads one member after it was inserted or edited."""
+        with self._lock:
+            row = self._connection().execute(
+                f"SELECT m.first_name, {self._member_source()} WHERE m.member_id = ?",
+                self._model_params() + (member_id,),
+            ).fetchone()
+            self._drop_member(member_id, keep_lab=row[3] if row else None)
+            if row is not None:
+                gallery = self._labs.get(row[3])
+                if gallery is not None:
+                    self._update_member(gallery, member_id, row[0], row[1], row[2])
+            self._absorb_data_version()
+
+    def member_removed(self, member_id):
+        with self._lock:
+            self._drop_member(member_id)
+            self._absorb_data_version()
+
+    def invalidate(self, lab_id=None):
+        """Forgets one lab, or every lab when lab_id is None."""
+        with self._lock:
+            if lab_id is None:
+                self._labs.clear()
+            else:
+                self._labs.pop(lab_id, None)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # ---------- internals ----------
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._data_version = None
+            self._catalog_version = None
+        return self._conn
+
+    def _read_data_version(self):
+        return self._connection().execute("PRAGMA data_version").fetchone()[0]
+
+    def _absorb_data_version(self):
+        # our own notification already covered the write that bumped it
+        self._data_version = self._read_data_version()
+        self._catalog_version = database.catalog_version(self._connection())
+
+    def _check_data_version(self):
+        # data_version is free to read; the catalog counter only when something was committed
+        version = self._read_data_version()
+        if self.codebooks is not None and version == self._data_version:
+            return
+        catalog = database.catalog_version(self._connection())
+        # without the counter (older schema) any commit counts as a change
+        changed = self._data_version is not None and (catalog is None or catalog != self._catalog_version)
+        if self.codebooks is None or changed:
+            self.codebooks = load_codebooks(self._connection())
+        if changed:
+            for lab_id in list(self._labs):
+                self._resync_lab(lab_id)
+        self._data_version = version
+        self._catalog_version = catalog
+
+    def _member_source(self):
+        """'template, face_ref, lab_id FROM ...' with LabMember aliased m."""
+        if self.model is None:
+            return "m.face_template, m.face_ref, m.lab_id FROM LabMember m"
+        # a side-table template made from an older image of the member does not count
+        return ("CASE WHEN m.template_model IS ? THEN m.face_template ELSE t.template END, "
+                "m.face_ref, m.lab_id FROM LabMember m LEFT JOIN LabMemberTemplate t "
+                "ON t.member_id = m.member_id AND t.model = ? AND t.face_ref IS m.face_ref")
+
+    def _model_params(self):
+        return () if self.model is None else (self.model, self.model)
+
+    def _fetch_lab_rows(self, lab_id):
+        rows = self._connection().execute(
+            f"SELECT m.member_id, m.first_name, {self._member_source()} WHERE m.lab_id = ? ORDER BY m.member_id",
+            self._model_params() + (lab_id,),
+        ).fetchall()
+        return [row[:4] for row in rows]
+
+    def _load_lab(self, lab_id) -> LabGallery:
+        gallery = LabGallery()
+        for member_id, first_name, template, face_ref in self._fetch_lab_rows(lab_id):
+            self._update_member(gallery, member_id, first_name, template, face_ref)
+        return gallery
+
+    def _resync_lab(self, lab_id):
+        """Brings a loaded lab up to date, embedding only rows that changed."""
+        gallery = self._labs[lab_id]
+        seen = set()
+        for member_id, first_name, template, face_ref in self._fetch_lab_rows(lab_id):
+            seen.add(member_id)
+            self._update_member(gallery, member_id, first_name, template, face_ref)
+        for member_id in set(gallery.members) - seen:
+            gallery.remove(member_id)
+
+    def _update_member(self, gallery, member_id, first_name, template, face_ref):
+        if not self.use_stored_templates:
+            template = None
+        image = None
+        if template is not None:
+            source = template
+        elif face_ref is not None:
+            source = face_ref.encode()  # already a content hash of the image
+        else:
+            # legacy row with its image inline in facial_id
+            source = image = load_member_image(self._connection(), member_id, None)
+        if source is None:
+            gallery.remove(member_id)
+            return
+        digest = _digest(source)
+        current = gallery.members.get(member_id)
+        if current is not None and current[1] == digest:
+            if current[0] != first_name:
+                gallery.put(member_id, first_name, digest, current[2])
+            return
+        if template is None:
+            if image is None:
+                image = load_member_image(self._connection(), member_id, face_ref)
+            template = self.make_template(image) if image is not None else None
+            if template is not None and self.store_built:
+                self._store_template(member_id, template, face_ref)
+        if template is None:
+            gallery.remove(member_id)
+        else:
+            gallery.put(member_id, first_name, digest, template)
+
+    def _store_template(self, member_id, template, face_ref):
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO LabMemberTemplate (member_id, model, template, face_ref, created) "
+                "VALUES (?, ?, ?, ?, datetime('now', 'localtime'))",
+                (member_id, self.model, template, face_ref),
+            )
+        # our own write: nothing to resync
+        self._catalog_version = database.catalog_version(conn)
+
+    def _drop_member(self, member_id, keep_lab=None):
+        for lab_id, gallery in self._labs.items():
+            if lab_id != keep_lab:
+                gallery.remove(member_id)
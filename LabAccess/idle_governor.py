@@ -0,0 +1,99 @@
+"""Lowers the capture rate while nobody is at the door.
+
+While IDLE the governor only looks at a tiny grayscale thumbnail of each frame
+and compares it with the previous one, polling the camera a few times a
+second. Motion switches it to ACTIVE, where frames are taken at the camera's
+full rate and the face detector runs periodically; after IDLE_TIMEOUT seconds
+without motion or a face it drops back to IDLE. Time spent in each state is
+kept so deployments can see how much of the day a door is really busy.
+"""
+import time
+
+import cv2
+import numpy as np
+
+IDLE = "idle"
+ACTIVE = "active"
+
+IDLE_DELAY_MS = 500       # camera poll interval while idle
+IDLE_TIMEOUT = 10.0       # seconds without activity before going idle
+DETECT_INTERVAL = 0.5     # seconds between face detections while active
+MOTION_THRESHOLD = 8.0    # mean absolute thumbnail difference (0-255)
+THUMB_SIZE = (64, 48)
+
+
+class IdleGovernor:
+    """Tracks IDLE/ACTIVE state from frames.
+
+    ``detect(frame)`` is optional and returns True when a face is visible.
+    """
+
+    def __init__(self, detect=None, clock=time.monotonic):
+        self.detect = detect
+        self.clock = clock
+        self.state = IDLE
+        self.time_in_state = {IDLE: 0.0, ACTIVE: 0.0}
+        self.wakeups = 0
+        now = clock()
+        self._state_since = now
+        self._last_activity = now
+        self._last_detect = None
+        self._last_seq = None
+        self._thumb = np.empty((THUMB_SIZE[1], THUMB_SIZE[0], 3), dtype=np.uint8)
+        self._gray = np.empty((THUMB_SIZE[1], THUMB_SIZE[0]), dtype=np.uint8)
+        self._previous = None
+
+    @property
+    def active(self) -> bool:
+        return self.state == ACTIVE
+
+    def observe(self, frame) -> str:
+        """Updates the state from a Frame (repeat frames are ignored)."""
+        if frame is None or frame.seq == self._last_seq:
+            return self.state
+        self._last_seq = frame.seq
+        now = self.clock()
+
+        if self._motion(frame.view):
+            self._last_activity = now
+        if self.active and self.detect is not None and (
+                self._last_detect is None or now - self._last_detect >= DETECT_INTERVAL):
+            self._last_detect = now
+            if self.detect(frame):
+                self._last_activity = now
+
+        if now - self._last_activity < IDLE_TIMEOUT:
+            self._switch(ACTIVE, now)
+        else:
+            self._switch(IDLE, now)
+        return self.state
+
+    def pace(self, frame, active_delay) -> int:
+        """Observes frame and returns the ms to wait before the next capture."""
+        return active_delay if self.observe(frame) == ACTIVE else IDLE_DELAY_MS
+
+    def report(self):
+        """Returns seconds spent per state, including the current stretch."""
+        totals = dict(self.time_in_state)
+        totals[self.state] += self.clock() - self._state_since
+        return totals
+
+    def _switch(self, state, now):
+        if state == self.state:
+            return
+        self.time_in_state[self.state] += now - self._state_since
+        self._state_since = now
+        self.state = state
+        if state == ACTIVE:
+            self.wakeups += 1
+            self._last_detect = None
+
+    def _motion(self, image) -> bool:
+        cv2.resize(image, THUMB_SIZE, dst=self._thumb, interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(self._thumb, cv2.COLOR_BGR2GRAY)
+        if self._previous is None:
+            self._previous = gray
+            return False
+        cv2.absdiff(gray, self._previous, dst=self._gray)
+        self._previous = gray
+        return float(self._gray.mean()) > MOTION_THRESHOLD
@@ -0,0 +1,267 @@
+"""Optional multiprocessing execution mode for recognition.
+
+Each worker process holds its own replica of the detector, embedding model and
+gallery cache, so detection, drawing and matching run in parallel instead of
+taking turns on one GIL. Frames live in a shared-memory FramePool and only a
+small (slot, shape, lab_id) tuple is pickled per scan; cameras that capture
+straight into ``pool.frames`` hand frames over without any copy. A supervisor
+thread restarts any worker that dies and resubmits the scans it was holding.
+Restarts back off exponentially, so a worker that dies on startup (e.g. the
+model fails to load) is not respawned in a tight loop. After MAX_RESTARTS
+crashes in a row the worker is given up. Once every worker is given up, the
+pool is marked unhealthy and fails its pending scans.
+
+Used by door_controller.py with ``--processes N``.
+"""
+import itertools
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from frame_buffer import Frame, FramePool, MAX_FRAME_BYTES
+
+POOL_SIZE = 2                          # worker processes / model replicas
+MAX_ATTEMPTS = 2                       # tries per scan before it is failed
+SUPERVISE_INTERVAL = 0.5               # seconds between worker health checks
+RESTART_BACKOFF = 0.5                  # seconds before restarting a crashed worker; doubles per crash
+MAX_BACKOFF = 30.0
+MAX_RESTARTS = 5                       # crashes in a row before a worker is given up
+STABLE_AFTER = 60.0                    # seconds of uptime that reset a worker's crash count
+
+
+class WorkerCrashed(RuntimeError):
+    """A scan's worker died MAX_ATTEMPTS times while holding it."""
+
+
+def _worker_main(slot_names, tasks, results):
+    """Worker process loop: recognize frames read straight out of shared memory."""
+    import facial_recognition as fr
+
+    blocks = {}
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            task_id, slot, shape, lab_id = task
+            if slot not in blocks:
+                blocks[slot] = shared_memory.SharedMemory(name=slot_names[slot])
+            frame = np.ndarray(shape, dtype=np.uint8, buffer=blocks[slot].buf)
+            try:
+                result = fr.recognize_frame(frame, lab_id)
+            except Exception as exc:
+                results.put((task_id, None, repr(exc)))
+            else:
+                results.put((task_id, result, None))
+            del frame
+    finally:
+        fr.close()
+        for block in blocks.values():
+            block.close()
+
+
+class _Task:
+    def __init__(self, frame, lab_id):
+        self.frame = frame
+        self.lab_id = lab_id
+        self.future = Future()
+        self.worker = None
+        self.attempts = 0
+
+
+class InferencePool:
+    """A supervised pool of recognition processes fed through shared memory."""
+
+    def __init__(self, size=POOL_SIZE, max_frame_bytes=MAX_FRAME_BYTES, slots=None):
+        self.size = size
+        self.max_frame_bytes = max_frame_bytes
+        self.restarts = 0
+        self.healthy = True
+        self._ctx = multiprocessing.get_context("spawn")
+        self.frames = FramePool(max_frame_bytes, slots or size * 2, shared=True)
+        self._results = self._ctx.Queue()
+        self._workers = [None] * size    # (process, task queue) per replica; None while down
+        self._started = [0.0] * size
+        self._crashes = [0] * size       # crashes in a row per replica
+        self._restart_at = [None] * size # when a crashed replica is due to restart
+        self._backlog = []               # task_ids waiting for any replica to be up
+        self._tasks = {}                 # task_id -> _Task still in flight
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._closing = False
+
+        for idx in range(size):
+            self._start_worker(idx)
+        self._threads = [
+            threading.Thread(target=self._collect_results, daemon=True),
+            threading.Thread(target=self._supervise, daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    # ---------- public API ----------
+
+    def submit(self, frame, lab_id) -> Future:
+        """Queues a frame for recognition.
+
+        A Frame from ``self.frames`` is shared with the worker as is; anything
+        else is copied into a free slot, blocking while all slots are busy.
+        """
+        if isinstance(frame, Frame) and frame.pool is self.frames:
+            frame = frame.retain()
+        else:
+            frame = self.frames.write(frame.view if isinstance(frame, Frame) else frame)
+
+        task = _Task(frame, lab_id)
+        with self._lock:
+            if self._closing or not self.healthy:
+                frame.release()
+                raise RuntimeError("inference pool is " + ("closed" if self._closing else "unhealthy"))
+            self._dispatch(next(self._ids), task)
+        return task.future
+
+    def recognize(self, frame, lab_id):
+        """Blocking helper with the same signature as fr.recognize_frame.
+
+        A scan that keeps crashing its worker is answered as denied, so the
+        caller's scheduling thread carries on with the next frame.
+        """
+        try:
+            return self.submit(frame, lab_id).result()
+        except WorkerCrashed:
+            print(f"[WARN] Scan for lab {lab_id} crashed {MAX_ATTEMPTS} workers; denying it.")
+            return (False, None)
+
+    def close(self):
+        with self._lock:
+            self._closing = True
+            workers = [worker for worker in self._workers if worker is not None]
+        for process, tasks in workers:
+            tasks.put(None)
+        for process, _ in workers:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        for thread in self._threads:
+            thread.join()
+        with self._lock:
+            for task in self._tasks.values():
+                task.frame.release()
+                task.future.set_exception(RuntimeError("inference pool closed"))
+            self._tasks.clear()
+            self._backlog = []
+        self.frames.close()
+
+    # ---------- internals ----------
+
+    def _start_worker(self, idx):
+        tasks = self._ctx.Queue()
+        slot_names = self.frames.slot_names()
+        process = self._ctx.Process(
+            target=_worker_main, args=(slot_names, tasks, self._results), daemon=True
+        )
+        process.start()
+        self._workers[idx] = (process, tasks)
+        self._started[idx] = time.monotonic()
+
+    def _dispatch(self, task_id, task):
+        self._tasks[task_id] = task
+        live = [idx for idx, worker in enumerate(self._workers) if worker is not None]
+        if not live:
+            # every replica is restarting: hold the scan until one is back
+            task.worker = None
+            self._backlog.append(task_id)
+            return
+        # least-loaded replica gets the scan
+        load = [0] * self.size
+        for other in self._tasks.values():
+            if other.worker is not None:
+                load[other.worker] += 1
+        task.worker = min(live, key=load.__getitem__)
+        task.attempts += 1
+        self._workers[task.worker][1].put((task_id, task.frame.slot, task.frame.shape, task.lab_id))
+
+    def _finish(self, task_id):
+        task = self._tasks.pop(task_id, None)
+        if task is not None:
+            task.frame.release()
+        return task
+
+    def _collect_results(self):
+        while True:
+            try:
+                task_id, result, error = self._results.get(timeout=SUPERVISE_INTERVAL)
+            except queue.Empty:
+                if self._closing:
+                    return
+                continue
+            with self._lock:
+                task = self._finish(task_id)
+            if task is None:
+                continue
+            if error is None:
+                task.future.set_result(result)
+            else:
+                task.future.set_exception(RuntimeError(error))
+
+    def _supervise(self):
+        while not self._closing:
+            time.sleep(SUPERVISE_INTERVAL)
+            with self._lock:
+                if self._closing:
+                    return
+                now = time.monotonic()
+                for idx, worker in enumerate(self._workers):
+                    if worker is None:
+                        if self._restart_at[idx] is not None and now >= self._restart_at[idx]:
+                            self._restart_at[idx] = None
+                            self.restarts += 1
+                            self._start_worker(idx)
+                            backlog, self._backlog = self._backlog, []
+                            for task_id in backlog:
+                                self._dispatch(task_id, self._tasks[task_id])
+                        continue
+                    process, _ = worker
+                    if process.is_alive():
+                        continue
+                    self._workers[idx] = None
+                    stable = now - self._started[idx] >= STABLE_AFTER
+                    self._crashes[idx] = 1 if stable else self._crashes[idx] + 1
+                    if self._crashes[idx] > MAX_RESTARTS:
+                        print(f"[WARN] Inference worker {idx} exited with code {process.exitcode} after "
+                              f"{MAX_RESTARTS} restarts in a row; giving up on it.")
+                    else:
+                        delay = min(RESTART_BACKOFF * 2 ** (self._crashes[idx] - 1), MAX_BACKOFF)
+                        print(f"[WARN] Inference worker {idx} exited with code {process.exitcode}; "
+                              f"restarting in {delay:.1f}s.")
+                        self._restart_at[idx] = now + delay
+                    self._resubmit(idx)
+                if all(w is None and r is None for w, r in zip(self._workers, self._restart_at)):
+                    self._fail_all()
+                    return
+
+    def _fail_all(self):
+        """Marks the pool unhealthy and fails every scan still in flight."""
+        print("[WARN] Every inference worker keeps crashing; the pool is unhealthy.")
+        self.healthy = False
+        for task_id in list(self._tasks):
+            task = self._finish(task_id)
+            task.future.set_exception(RuntimeError("inference pool is unhealthy"))
+        self._backlog = []
+
+    def _resubmit(self, idx):
+        for task_id, task in list(self._tasks.items()):
+            if task.worker != idx:
+                continue
+            if task.attempts >= MAX_ATTEMPTS:
+                self._finish(task_id)
+                task.future.set_exception(WorkerCrashed("inference worker crashed"))
+            else:
+                del self._tasks[task_id]
+                task.worker = None
+                self._dispatch(task_id, task)
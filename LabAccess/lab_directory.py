@@ -0,0 +1,98 @@
+"""In-memory directory of labs for lab selection and kiosk binding.
+
+Labs are loaded once into dictionaries indexed by id and by case-insensitive
+name, together with the building and room they live in. The directory reloads
+itself only when the CatalogVersion counter shows that a catalog table
+changed; logged scans leave it alone.
+"""
+import sqlite3
+import threading
+from typing import NamedTuple, Optional
+
+import database
+
+DEFAULT_BUILDING = "EIEAB"
+DEFAULT_ROOM = "2.126"
+
+
+class LabInfo(NamedTuple):
+    lab_id: int
+    lab_name: str
+    building: str
+    room: str
+
+
+def _key(name) -> str:
+    return " ".join(name.split()).casefold()
+
+
+class LabDirectory:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._by_id = {}
+        self._by_name = {}
+        self._lock = threading.RLock()
+        self._conn = None
+        self._data_version = None
+        self._catalog_version = None
+
+    def load(self):
+        """Reads every lab from the database and rebuilds the indexes."""
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT lab_id, lab_name, building, room FROM Lab"
+            ).fetchall()
+            by_id, by_name = {}, {}
+            for lab_id, lab_name, building, room in rows:
+                lab = LabInfo(lab_id, lab_name or "", building or DEFAULT_BUILDING, room or DEFAULT_ROOM)
+                by_id[lab_id] = lab
+                if lab_name:
+                    by_name[_key(lab_name)] = lab
+            self._by_id, self._by_name = by_id, by_name
+            self._data_version = self._read_data_version()
+            self._catalog_version = database.catalog_version(self._connection())
+
+    def find(self, name) -> Optional[LabInfo]:
+        """Looks a lab up by its name, ignoring case and extra spaces."""
+        if not name:
+            return None
+        with self._lock:
+            self._refresh_if_changed()
+            return self._by_name.get(_key(name))
+
+    def get(self, lab_id) -> Optional[LabInfo]:
+        with self._lock:
+            self._refresh_if_changed()
+            return self._by_id.get(lab_id)
+
+    def labs(self):
+        with self._lock:
+            self._refresh_if_changed()
+            return sorted(self._by_id.values())
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+                self._data_version = None
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        return self._conn
+
+    def _read_data_version(self):
+        return self._connection().execute("PRAGMA data_version").fetchone()[0]
+
+    def _refresh_if_changed(self):
+        if self._data_version is None:
+            self.load()
+            return
+        version = self._read_data_version()
+        if version == self._data_version:
+            return
+        self._data_version = version
+        catalog = database.catalog_version(self._connection())
+        if catalog is None or catalog != self._catalog_version:
+            self.load()
@@ -1,28 +1,50 @@
 import tkinter as tk
-from tkinter import ttk, simpledialog, messagebox
+from tkinter import ttk, simpledialog, messagebox, filedialog
 from datetime import datetime
+from io import BytesIO
 import cv2
 from PIL import Image, ImageTk
 import sqlite3
-import mediapipe as mp
 from functools import partial
+import sys
+import threading
 
 import facial_recognition as fr
+import database
+import access_log
+import access_export
+import sync
+from face_store import store as face_store, THUMB_SIZE
+from frame_buffer import FramePool
+from preview_renderer import PreviewRenderer, HIDDEN_DELAY_MS
+from idle_governor import IdleGovernor
+from lab_directory import LabDirectory, DEFAULT_BUILDING, DEFAULT_ROOM
 
 ADMIN_PASSCODE = "1234"          # TODO: change for real use
 CAMERA_INDEX = 0                
 
 class AccessApp(tk.Tk):
-    def __init__(self):
+    def __init__(self, kiosk_lab=None):
         super().__init__()
 
         self.title("Face Recognition Access Control")
         self.configure(bg="#101018")
         self.geometry("420x720")  # phone-like aspect ratio
 
-        # current lab metadata (could later be dynamic)
-        self.current_building = "EIEAB"
-        self.current_room = "2.126"
+        # current lab metadata, filled in from the lab directory on scan
+        self.current_building = DEFAULT_BUILDING
+        self.current_room = DEFAULT_ROOM
+
+        # labs indexed by id and name, loaded once at startup
+        self.set_tables()
+        self.labs = LabDirectory("thedatabase.db")
+        self.labs.load()
+        conn = self.connect_db("thedatabase.db")
+        # members are enrolled on the central node and replicated here
+        self.replica = sync.is_replica(conn)
+        conn.close()
+        # no-op unless a shadow_model is configured (reembed.py shadow)
+        fr.start_shadow()
 
         # visit log: (building, room, name) -> count
         self.visit_counts = {}
@@ -36,14 +58,24 @@ class AccessApp(tk.Tk):
 
         # OpenCV / camera state
         self.cap = None              # cv2.VideoCapture
-        self.current_frame = None    # last captured frame
-        self.camera_photo = None     # Tk image for main camera view
-        self.preview_photo = None    # Tk image for preview box
+        self.frames = FramePool(count=3)  # reused capture buffers
+        self.current_frame = None    # last captured frame (read-only Frame)
+        self.renderer = None         # paints frames into the scan screen
+        self.governor = None         # slows the camera down while idle
+
+        # pending after() callbacks, so re-entering a screen doesn't stack loops
+        self.time_job = None
+        self.camera_job = None
 
         # release camera on close
         self.protocol("WM_DELETE_WINDOW", self.on_close)
 
-        self.show_home()
+        # a kiosk bound to one lab goes straight to its scan screen
+        lab = self.labs.find(kiosk_lab)
+        if lab is not None:
+            self.show_scan_screen(lab.lab_id)
+        else:
+            self.show_home()
 
     # ---------- generic helpers ----------
 
@@ -85,20 +117,16 @@ class AccessApp(tk.Tk):
 
     def set_tables(self):
         conn = sqlite3.connect("thedatabase.db")
-        cursor = conn.cursor()
-        cursor.execute("CREATE TABLE IF NOT EXISTS Lab (lab_id INTEGER PRIMARY KEY, lab_name TEXT, facial_id TEXT)")
-        cursor.execute("CREATE TABLE IF NOT EXISTS LabMember (member_id INTEGER PRIMARY KEY, first_name TEXT, last_name TEXT, facial_id BLOB, lab_id INTEGER)")
-        cursor.execute("CREATE TABLE IF NOT EXISTS LabAccess (accessID INTEGER PRIMARY KEY, member_id INTEGER, lab_id INTEGER, time_stamp TEXT, access_type TEXT, result TEXT, FOREIGN KEY(member_id) REFERENCES LabMember(member_id), FOREIGN KEY(lab_id) REFERENCES Lab(lab_id))")
-        conn.commit()
+        database.ensure_schema(conn)
         conn.close()
 
     def connect_db(self, db_name):
         conn = sqlite3.connect(db_name)
         return conn
     
-    def fetch_data(self, conn, table_name):
+    def fetch_data(self, conn, table_name, columns="*"):
         cursor = conn.cursor()
-        cursor.execute(f"SELECT * FROM {table_name}")
+        cursor.execute(f"SELECT {columns} FROM {table_name}")
         data = cursor.fetchall()
         column_names = [description[0] for description in cursor.description]
         return data, column_names
@@ -133,7 +161,7 @@ class AccessApp(tk.Tk):
 
             print(self.primary_key_column)
 
-            if col == self.primary_key_column:
+            if col == self.primary_key_column or col in self.readonly_columns:
                 entry.config(state="readonly")
             
             entry.pack(pady=5)
@@ -142,6 +170,10 @@ class AccessApp(tk.Tk):
         tk.Button(win, text="Save", command=lambda: self.save_record_changes(win)).pack(pady=20)
 
     def save_record_changes(self,window):
+        # members and labs are both synced from the central node
+        if self.last_table_name in ("LabMember", "Lab") and self.replica:
+            self.show_replica_error()
+            return
         conn = self.connect_db("thedatabase.db")
         cursor = conn.cursor()
 
@@ -151,7 +183,10 @@ class AccessApp(tk.Tk):
         pk_idx = self.edit_column_names.index(primary_key_col)
         primary_key_value = self.current_edit_values[pk_idx]
 
-        editable_columns = [col for col in self.edit_column_names if col != primary_key_col]
+        editable_columns = [
+            col for col in self.edit_column_names
+            if col != primary_key_col and col not in self.readonly_columns
+        ]
         set_clause = ", ".join([f"{col} = ?" for col in editable_columns])
 
         print(self.last_table_name)
@@ -168,18 +203,34 @@ class AccessApp(tk.Tk):
         conn.commit()
         conn.close()
 
+        if self.last_table_name == "LabMember":
+            fr.member_changed(int(primary_key_value))
+
         window.destroy()
-        self.show_admin_panel()
+        if self.last_table_name == "Lab":
+            self.show_lab_admin()
+        else:
+            self.show_admin_panel()
     
-    def display_data_in_treeview(self,root, data, column_names):
-        tree = ttk.Treeview(root, columns=column_names, show='headings')
+    def display_data_in_treeview(self,root, data, column_names, thumbnails=None):
+        if thumbnails is None:
+            tree = ttk.Treeview(root, columns=column_names, show='headings')
+        else:
+            # one image per row in the tree column; rows must be tall enough
+            ttk.Style(self).configure("Thumb.Treeview", rowheight=THUMB_SIZE[1] + 4)
+            tree = ttk.Treeview(root, columns=column_names, show='tree headings', style="Thumb.Treeview")
+            tree.column("#0", width=THUMB_SIZE[0] + 12, stretch=False)
 
         for col in column_names:
             tree.heading(col, text=col.replace('_', ' ').title())
             tree.column(col, width=100, anchor='center')
         
-        for row in data:
-            tree.insert("","end", values=row)
+        for idx, row in enumerate(data):
+            image = thumbnails[idx] if thumbnails else None
+            if image is not None:
+                tree.insert("","end", values=row, image=image)
+            else:
+                tree.insert("","end", values=row)
         
         tree.pack(pady=10)
 
@@ -191,21 +242,10 @@ class AccessApp(tk.Tk):
         code = simpledialog.askstring(
             "Lab Selection", "Enter lab:"
         )
-        conn = self.connect_db("thedatabase.db")
-        cursor = conn.cursor()
-
-        cursor.execute('''SELECT lab_id, lab_name FROM LAB''')
-  
-        output = cursor.fetchall()
-
-        for row in output:
-            if row[1] == code:
-                self.show_scan_screen(row[0])
-                conn.commit()
-                conn.close()
-                return
-        conn.commit()
-        conn.close()
+        lab = self.labs.find(code)
+        if lab is not None:
+            self.show_scan_screen(lab.lab_id)
+            return
 
         if not code:
             return
@@ -239,20 +279,25 @@ class AccessApp(tk.Tk):
 
         conn = self.connect_db("thedatabase.db")
         self.set_tables()
-        data, column_names = self.fetch_data(conn, "LabMember")
+        # image and template blobs stay out of the listing; faces show as thumbnails
+        data, column_names = self.fetch_data(conn, "LabMember", "member_id, first_name, last_name, lab_id, face_ref")
 
         conn.close()
         self.primary_key_column = "member_id"
+        self.readonly_columns = {"face_ref"}
         self.last_column_names = column_names
         self.last_table_name = "LabMember"
     
         tree_container = tk.Frame(frame, bg="#101018")
         tree_container.pack(pady=10)
-        self.display_data_in_treeview(tree_container, data, column_names)
+        self.member_thumbnails = [self.load_thumbnail(row[-1]) for row in data]
+        self.display_data_in_treeview(tree_container, data, column_names, self.member_thumbnails)
 
         button_row = tk.Frame(frame,bg="#101018")
         button_row.pack(pady= 20)
         ttk.Button(button_row, text="Add New User", command=self.register_student_screen).pack(side="left",pady=20)
+        ttk.Button(button_row, text="Export Access Log", command=self.export_access_log).pack(side="left",pady=20)
+        ttk.Button(button_row, text="Manage Labs", command=self.show_lab_admin).pack(side="left",pady=20)
         #ttk.Button(button_row, text="Check Access Logs", command=self.show_access_log).pack(side="left",pady=20)
 
         ttk.Button(frame, text="Back", command=self.show_home).pack(pady=30)
@@ -273,8 +318,55 @@ class AccessApp(tk.Tk):
         #     justify="left",
         # ).pack()
 
+    def show_lab_admin(self):
+        self.clear_screen()
+
+        frame = tk.Frame(self, bg="#101018")
+        frame.pack(expand=True, fill="both", padx=20, pady=20)
+
+        tk.Label(
+            frame,
+            text="Labs",
+            font=("Helvetica", 14, "bold"),
+            fg="white",
+            bg="#101018",
+            justify="center",
+        ).pack(pady=40)
+
+        # unset locations show (and save) as the defaults the scan screen uses
+        conn = self.connect_db("thedatabase.db")
+        data, column_names = self.fetch_data(
+            conn,
+            "Lab",
+            f"lab_id, lab_name, COALESCE(building, '{DEFAULT_BUILDING}') AS building, "
+            f"COALESCE(room, '{DEFAULT_ROOM}') AS room",
+        )
+
+        conn.close()
+        self.primary_key_column = "lab_id"
+        self.readonly_columns = set()
+        self.last_column_names = column_names
+        self.last_table_name = "Lab"
+
+        tree_container = tk.Frame(frame, bg="#101018")
+        tree_container.pack(pady=10)
+        self.display_data_in_treeview(tree_container, data, column_names)
+
+        ttk.Button(frame, text="Back", command=self.show_admin_panel).pack(pady=30)
+
+    def load_thumbnail(self, face_ref):
+        if not face_ref:
+            return None
+        data = face_store.thumbnail(face_ref)
+        if data is None:
+            return None
+        return ImageTk.PhotoImage(Image.open(BytesIO(data)))
+
     # ---------- registration ----------
     def show_student_registration(self, blob):
+        if self.replica:
+            self.show_replica_error()
+            return
         first_name = simpledialog.askstring(
             "First Name", "Enter student's first name:"
         )
@@ -294,16 +386,33 @@ class AccessApp(tk.Tk):
             messagebox.showerror("Error", "Invalid lab ID.")
             return
 
+        embedding = fr.embed_blob(blob)
+        template = fr.encode_template(embedding) if embedding is not None else None
+        if embedding is not None and lab_id.isdigit():
+            closest = fr.closest_member(embedding, int(lab_id))
+            if closest is not None and closest[2] < fr.MATCH_THRESHOLD:
+                # the new face would already be granted as someone else
+                if not messagebox.askyesno(
+                    "Possible Duplicate",
+                    f"This face matches {closest[1]} (member {closest[0]}, distance {closest[2]:.2f}) "
+                    "who is already enrolled in this lab.\n\nEnroll anyway?",
+                ):
+                    return
+
         conn = self.connect_db("thedatabase.db")
         cursor = conn.cursor()
 
         output = cursor.fetchall()
 
-        cursor.execute("INSERT INTO LabMember (first_name,last_name,facial_id,lab_id) VALUES (?,?,?,?)",
-                       (first_name,last_name,blob,int(lab_id)))
+        face_ref = face_store.put(blob)
+        cursor.execute("INSERT INTO LabMember (first_name,last_name,face_ref,face_template,template_model,lab_id) VALUES (?,?,?,?,?,?)",
+                       (first_name,last_name,face_ref,template,fr.MODEL_NAME,int(lab_id)))
+        member_id = cursor.lastrowid
     
         conn.commit()
         conn.close()
+
+        fr.member_changed(member_id)
     
     # ---------- access logs ----------
 
@@ -322,11 +431,13 @@ class AccessApp(tk.Tk):
             justify="center",
         ).pack(pady=40)
 
+        # only the newest raw rows; older history lives in the rollups and archives
         conn = self.connect_db("thedatabase.db")
-        data, column_names = self.fetch_data(conn, "LabAccess")
+        data, column_names = access_log.recent(conn)
 
         conn.close()
         self.primary_key_column = "accessID"
+        self.readonly_columns = set()
         self.last_column_names = column_names
         self.last_table_name = "LabAccess"
     
@@ -340,6 +451,66 @@ class AccessApp(tk.Tk):
         ttk.Button(frame, text="Back", command=self.show_admin_panel).pack(pady=30)
         ttk.Button(frame, text="Home", command=self.show_home).pack(pady=30)
 
+    def export_access_log(self):
+        path = filedialog.asksaveasfilename(
+            title="Export Access Log",
+            defaultextension=".csv",
+            filetypes=[("CSV", "*.csv"), ("Parquet", "*.parquet")],
+        )
+        if not path:
+            return
+        lab_name = simpledialog.askstring("Export Access Log", "Lab (blank for all labs):")
+        since = simpledialog.askstring("Export Access Log", "From date YYYY-MM-DD (blank for the beginning):")
+        until = simpledialog.askstring("Export Access Log", "Until date YYYY-MM-DD, excluded (blank for no end):")
+        try:
+            since, until = access_export.parse_day(since), access_export.parse_day(until)
+        except ValueError:
+            messagebox.showerror("Error", "Dates must be given as YYYY-MM-DD.")
+            return
+        if since and until and since >= until:
+            messagebox.showerror("Error", "The from date must be before the until date.")
+            return
+        lab_id = None
+        if lab_name:
+            lab = self.labs.find(lab_name)
+            if lab is None:
+                messagebox.showerror("Error", "Invalid lab.")
+                return
+            lab_id = lab.lab_id
+
+        # the export runs on its own connection and thread; the UI polls its progress
+        status = {"rows": 0, "done": False, "error": None}
+
+        def run():
+            conn = self.connect_db("thedatabase.db")
+            try:
+                access_export.export_access(conn, path, lab_id, since, until,
+                                            progress=lambda n: status.update(rows=n))
+            except Exception as exc:
+                status["error"] = exc
+            finally:
+                conn.close()
+                status["done"] = True
+
+        window = tk.Toplevel(self)
+        window.title("Export Access Log")
+        label = tk.Label(window, text="Exporting…", padx=20, pady=20)
+        label.pack()
+
+        def poll():
+            if not status["done"]:
+                label.config(text=f"Exported {status['rows']} rows…")
+                self.after(200, poll)
+                return
+            window.destroy()
+            if status["error"] is not None:
+                messagebox.showerror("Export Failed", str(status["error"]))
+            else:
+                messagebox.showinfo("Export Complete", f"Exported {status['rows']} rows to {path}.")
+
+        threading.Thread(target=run, daemon=True).start()
+        poll()
+
     # ---------- scan / access flow ----------
 
     def open_camera(self) -> bool:
@@ -377,6 +548,11 @@ class AccessApp(tk.Tk):
     def show_scan_screen(self,lab_id):
         self.clear_screen()
 
+        lab = self.labs.get(lab_id)
+        if lab is not None:
+            self.current_building = lab.building
+            self.current_room = lab.room
+
         # open camera when entering scan screen
         if not self.open_camera():
             messagebox.showerror(
@@ -500,10 +676,23 @@ class AccessApp(tk.Tk):
         ttk.Button(btn_row, text="Back", command=self.back_from_scan).pack(side="right")
 
         # start updating time and camera
+        fps = self.cap.get(cv2.CAP_PROP_FPS) if self.cap is not None else 0
+        self.renderer = PreviewRenderer(self.camera_frame, self.preview_frame, fps)
+        self.governor = IdleGovernor(detect=fr.has_face)
         self.update_time()
         self.update_camera()
     
+    def show_replica_error(self):
+        messagebox.showerror(
+            "Central Enrollment",
+            "This kiosk is synced from the central database.\n"
+            "Add and edit labs and lab members on the central node.",
+        )
+
     def register_student_screen(self):
+        if self.replica:
+            self.show_replica_error()
+            return
         self.clear_screen()
 
         # open camera when entering scan screen
@@ -629,6 +818,9 @@ class AccessApp(tk.Tk):
         ttk.Button(btn_row, text="Back", command=self.back_from_scan_registration).pack(side="right")
 
         # start updating time and camera
+        fps = self.cap.get(cv2.CAP_PROP_FPS) if self.cap is not None else 0
+        self.renderer = PreviewRenderer(self.camera_frame, self.preview_frame, fps)
+        self.governor = IdleGovernor(detect=fr.has_face)
         self.update_time()
         self.update_camera()
 
@@ -637,6 +829,7 @@ class AccessApp(tk.Tk):
             self.cap.release()
             print("[INFO] Camera released from back button.")
         self.cap = None
+        self.log_idle_stats()
         self.show_home()
     
     def back_from_scan_registration(self):
@@ -644,10 +837,21 @@ class AccessApp(tk.Tk):
             self.cap.release()
             print("[INFO] Camera released from back button.")
         self.cap = None
+        self.log_idle_stats()
         self.show_admin_panel()
 
     # ---------- time and camera updates ----------
 
+    def log_idle_stats(self):
+        if self.governor is None:
+            return
+        times = self.governor.report()
+        print(
+            f"[INFO] Camera idle {times['idle']:.0f}s, active {times['active']:.0f}s, "
+            f"{self.governor.wakeups} wakeups."
+        )
+        self.governor = None
+
     def update_time(self):
         now = datetime.now()
         time_str = now.strftime("%H:%M  %B %d, %A")
@@ -656,37 +860,27 @@ class AccessApp(tk.Tk):
                 self.time_label.config(text=time_str)
             except tk.TclError:
                 pass
-        self.after(1000, self.update_time)
+        if self.time_job is not None:
+            self.after_cancel(self.time_job)
+        self.time_job = self.after(1000, self.update_time)
 
     def update_camera(self):
         """Grab a frame from OpenCV and display it in the Tkinter widgets."""
         if self.cap is not None and self.cap.isOpened():
-            ret, frame = self.cap.read()
+            ret, frame = self.frames.read(self.cap)
             if not ret:
                 print("[WARN] Failed to grab frame from camera.")
-            else:
+            elif frame is not None:
+                if self.current_frame is not None:
+                    self.current_frame.release()
                 self.current_frame = frame
 
-                # mirror horizontally and convert BGR -> RGB
-                frame_rgb = cv2.cvtColor(cv2.flip(frame, 1), cv2.COLOR_BGR2RGB)
-
-                # big image for main camera view
-                big_img = Image.fromarray(frame_rgb).resize((320, 400))
-                self.camera_photo = ImageTk.PhotoImage(big_img)
-                try:
-                    self.camera_frame.config(image=self.camera_photo, text="")
-                except tk.TclError:
-                    pass
-
-                # small image for preview box
-                small_img = big_img.resize((80, 80))
-                self.preview_photo = ImageTk.PhotoImage(small_img)
-                try:
-                    self.preview_frame.config(image=self.preview_photo, text="")
-                except tk.TclError:
-                    pass
-
-        self.after(30, self.update_camera)
+        delay = HIDDEN_DELAY_MS
+        if self.renderer is not None and self.cap is not None:
+            delay = self.governor.pace(self.current_frame, self.renderer.render(self.current_frame))
+        if self.camera_job is not None:
+            self.after_cancel(self.camera_job)
+        self.camera_job = self.after(delay, self.update_camera)
 
     # ---------- recognition integration ----------
 
@@ -704,10 +898,7 @@ class AccessApp(tk.Tk):
             )
             return
 
-        # Optional: save the frame so Aiden can inspect it or test his model.
-        # This writes a BGR image as captured by OpenCV.
-        mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=self.current_frame)
-        result = fr.is_face_recognized(mp_image,lab_id)
+        result = fr.recognize_frame(self.current_frame, lab_id)
         if result[0]:
             self.handle_recognition_result(result[1])
         else:
@@ -724,10 +915,7 @@ class AccessApp(tk.Tk):
             )
             return
 
-        # Optional: save the frame so Aiden can inspect it or test his model.
-        # This writes a BGR image as captured by OpenCV.
-        mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=self.current_frame)
-        result = fr.register_face(mp_image)
+        result = fr.register_face(fr.to_mp_image(self.current_frame))
 
         if result:
             self.show_student_registration(result)
@@ -866,9 +1054,12 @@ class AccessApp(tk.Tk):
         if self.cap is not None and self.cap.isOpened():
             self.cap.release()
             print("[INFO] Camera released on window close.")
+        fr.close()
+        self.labs.close()
         self.destroy()
 
 
 if __name__ == "__main__":
-    app = AccessApp()
+    # optional lab name binds this kiosk to that lab's scan screen
+    app = AccessApp(kiosk_lab=sys.argv[1] if len(sys.argv) > 1 else None)
     app.mainloop()
@@ -0,0 +1,107 @@
+"""Paints camera frames into the scan screen's Tk labels.
+
+The frame is area-resized with OpenCV into preallocated buffers before it is
+mirrored and colour-converted, so those steps only touch preview-sized pixels.
+Both PhotoImages are created once and repainted in place. Nothing is drawn
+when the frame has not changed since the last paint or the widgets are not on
+screen. The next refresh is timed for the camera's next frame: its interval
+comes from CAP_PROP_FPS, or from the capture timestamps of the frames when
+the driver does not report a rate, less the time already spent since the
+current frame was captured.
+"""
+import time
+import tkinter as tk
+
+import cv2
+import numpy as np
+from PIL import Image, ImageTk
+
+CAMERA_SIZE = (320, 400)   # (width, height) of the main camera view
+PREVIEW_SIZE = (80, 80)    # (width, height) of the small preview box
+MIN_DELAY_MS = 10
+MAX_DELAY_MS = 100
+HIDDEN_DELAY_MS = 250      # poll rate while the camera view is not visible
+RATE_SMOOTHING = 0.2       # weight of the newest interval in the moving average
+
+
+class _Target:
+    """One label with its persistent PhotoImage and pixel buffers."""
+
+    def __init__(self, widget, size):
+        width, height = size
+        self.widget = widget
+        self.size = size
+        self.resized = np.empty((height, width, 3), dtype=np.uint8)
+        self.flipped = np.empty_like(self.resized)
+        # Pillow only shares memory with the buffer for 4-byte modes like RGBA;
+        # for RGB frombuffer takes a copy and the image would never change
+        self.rgba = np.empty((height, width, 4), dtype=np.uint8)
+        self.image = Image.frombuffer("RGBA", size, self.rgba, "raw", "RGBA", 0, 1)
+        self.photo = ImageTk.PhotoImage(self.image)
+        widget.config(image=self.photo, text="")
+
+    def paint(self, src):
+        cv2.resize(src, self.size, dst=self.resized, interpolation=cv2.INTER_AREA)
+        self.paint_resized()
+
+    def paint_resized(self):
+        # mirror horizontally and convert BGR -> RGBA, straight into the image's pixels
+        cv2.flip(self.resized, 1, dst=self.flipped)
+        cv2.cvtColor(self.flipped, cv2.COLOR_BGR2RGBA, dst=self.rgba)
+        self.photo.paste(self.image)
+
+
+class PreviewRenderer:
+    def __init__(self, camera_widget, preview_widget, fps=0):
+        self.camera = _Target(camera_widget, CAMERA_SIZE)
+        self.preview = _Target(preview_widget, PREVIEW_SIZE)
+        self.painted = 0
+        self.skipped = 0
+        self._last_seq = None
+        self._last_captured = None
+        self._measure = not fps or fps <= 0  # many drivers report 0 for CAP_PROP_FPS
+        self._frame_interval = None if self._measure else 1.0 / fps  # seconds
+
+    def visible(self) -> bool:
+        try:
+            return bool(self.camera.widget.winfo_viewable())
+        except tk.TclError:
+            return False
+
+    def render(self, frame) -> int:
+        """Paints frame if it is new and visible; returns ms until the next call."""
+        if not self.visible():
+            return HIDDEN_DELAY_MS
+        if frame is None or frame.seq == self._last_seq:
+            self.skipped += 1
+            return self.next_delay()
+
+        self._track_rate(frame)
+        self._last_seq = frame.seq
+        try:
+            self.camera.paint(frame.view)
+            # the preview is a downscale of the main view, as before
+            cv2.resize(self.camera.resized, PREVIEW_SIZE, dst=self.preview.resized,
+                       interpolation=cv2.INTER_AREA)
+            self.preview.paint_resized()
+        except tk.TclError:
+            return HIDDEN_DELAY_MS
+        self.painted += 1
+        return self.next_delay()
+
+    def next_delay(self) -> int:
+        """ms until the camera's next frame is due, counted from the last capture."""
+        if self._frame_interval is None or self._last_captured is None:
+            return MIN_DELAY_MS
+        remaining = self._frame_interval - (time.monotonic() - self._last_captured)
+        return max(MIN_DELAY_MS, min(MAX_DELAY_MS, int(remaining * 1000)))
+
+    def _track_rate(self, frame):
+        # capture times, not render times: the render delay must not feed back into the rate
+        if self._measure and self._last_captured is not None:
+            interval = frame.captured - self._last_captured
+            if self._frame_interval is None:
+                self._frame_interval = interval
+            else:
+                self._frame_interval += RATE_SMOOTHING * (interval - self._frame_interval)
+        self._last_captured = frame.captured
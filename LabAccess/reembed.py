@@ -0,0 +1,205 @@
+"""Regenerates member templates for a new embedding model.
+
+Every node embeds live faces with its own ``model`` from labaccess.json, and
+every template is tagged with the model that made it: LabMember carries
+face_template with its template_model, and the side table LabMemberTemplate
+holds one template per (member, model). A gallery only uses templates of its
+node's model, so a node never compares embeddings across models. Both tables
+are replicated to kiosks by sync.py.
+
+On the central node (which has the enrollment images):
+
+    python reembed.py run casia-webface --workers 4   # fill LabMemberTemplate
+    python reembed.py status casia-webface
+    python reembed.py activate casia-webface         # make it LabMember's model
+    python reembed.py run casia-webface --fast       # the cascade's first-stage templates
+
+``activate`` first files the outgoing templates in LabMemberTemplate under
+their old model, so kiosks still running the old weights keep matching after
+the new LabMember rows reach them. Then, on each kiosk:
+
+    python reembed.py shadow casia-webface           # optional: score live scans with both
+    python reembed.py shadow --off
+    python reembed.py activate casia-webface         # switch this node, then restart it
+
+On a kiosk ``activate`` only switches the local model, after checking that
+the replicated data covers every member. ``run`` reads images on a pool of
+loader threads while the model embeds the previous batch and commits each
+batch, so an interrupted run resumes with the members still missing. A
+template counts only if it was made from the member's current face_ref.
+With ``--fast`` run and status work on the downscaled first-stage templates
+of the recognition cascade (``fr.fast_model_name``), which kiosks cannot
+build themselves.
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import config
+import database
+import sync
+import template_codecs
+from face_store import load_member_image
+
+BATCH_SIZE = 32
+WORKERS = 4
+
+
+def pending_members(conn, model):
+    """(member_id, face_ref) of members without a current template for model."""
+    return conn.execute(
+        "SELECT m.member_id, m.face_ref FROM LabMember m LEFT JOIN LabMemberTemplate t "
+        "ON t.member_id = m.member_id AND t.model = ? AND t.face_ref IS m.face_ref "
+        "WHERE t.member_id IS NULL AND NOT (m.template_model IS ? AND m.face_template IS NOT NULL) "
+        "ORDER BY m.member_id",
+        (model, model),
+    ).fetchall()
+
+
+def status(conn, model):
+    total = conn.execute("SELECT COUNT(*) FROM LabMember").fetchone()[0]
+    missing = len(pending_members(conn, model))
+    return {"members": total, "done": total - missing, "missing": missing}
+
+
+def run(conn, model_name, workers=WORKERS, batch_size=BATCH_SIZE, progress=print, fast=False):
+    """Embeds every pending member with model_name; returns (done, failed).
+
+    With fast, the templates are the cascade's first stage, stored under
+    ``fr.fast_model_name(model_name)``.
+    """
+    if sync.is_replica(conn):
+        raise RuntimeError("kiosks have no enrollment images; run this on the central node")
+    import facial_recognition as fr
+
+    model = fr.load_model(model_name)
+    key = fr.fast_model_name(model_name) if fast else model_name
+    transform = fr.fast_preprocess if fast else fr.preprocess
+    pending = pending_members(conn, key)
+    batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+    progress(f"[INFO] {len(pending)} members to embed with {key}.")
+
+    def load(row):
+        member_id, face_ref = row
+        if face_ref:
+            blob = load_member_image(None, member_id, face_ref)
+        else:
+            # legacy inline image; connections can't be shared across loader threads
+            local = database.connect()
+            blob = load_member_image(local, member_id, None)
+            local.close()
+        return fr.decode_face(blob) if blob is not None else None
+
+    done = failed = 0
+    with ThreadPoolExecutor(workers) as loaders:
+        # keep the next batch loading while the current one is embedded
+        upcoming = [loaders.submit(load, row) for row in batches[0]] if batches else []
+        for index, batch in enumerate(batches):
+            futures = upcoming
+            if index + 1 < len(batches):
+                upcoming = [loaders.submit(load, row) for row in batches[index + 1]]
+            faces = [f.result() for f in futures]
+            ready = [(row, face) for row, face in zip(batch, faces) if face is not None]
+            for (member_id, _), face in zip(batch, faces):
+                if face is None:
+                    progress(f"[WARN] Member {member_id}: no usable enrollment image.")
+            failed += len(batch) - len(ready)
+            if not ready:
+                continue
+            embeddings = fr.embed_faces([face for _, face in ready], transform=transform, model=model)
+            created = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO LabMemberTemplate (member_id, model, template, face_ref, created) "
+                    "VALUES (?,?,?,?,?)",
+                    [(member_id, key, template_codecs.encode_template(e), face_ref, created)
+                     for ((member_id, face_ref), _), e in zip(ready, embeddings)],
+                )
+            done += len(ready)
+            progress(f"[INFO] {done}/{len(pending)} embedded.")
+    return done, failed
+
+
+def activate(conn, model_name, force=False):
+    """Makes model_name this node's model; returns the previous one.
+
+    On the central node LabMember's templates are switched too, after the
+    outgoing ones are kept in LabMemberTemplate for nodes not yet switched.
+    """
+    missing = status(conn, model_name)["missing"]
+    if missing and not force:
+        raise RuntimeError(f"{missing} members have no {model_name} template; run it again or use --force")
+    if not sync.is_replica(conn):
+        created = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO LabMemberTemplate (member_id, model, template, face_ref, created) "
+                "SELECT member_id, template_model, face_template, face_ref, ? FROM LabMember "
+                "WHERE face_template IS NOT NULL AND template_model IS NOT NULL AND template_model != ?",
+                (created, model_name),
+            )
+            # members without a new template lose their old one: it would never match
+            conn.execute(
+                "UPDATE LabMember SET template_model = ?, face_template = (SELECT t.template FROM LabMemberTemplate t "
+                "WHERE t.member_id = LabMember.member_id AND t.model = ? AND t.face_ref IS LabMember.face_ref) "
+                "WHERE template_model IS NOT ?",
+                (model_name, model_name, model_name),
+            )
+    settings = config.load()
+    config.save({"model": model_name, "shadow_model": None})
+    return settings["model"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-embed enrolled members for a new model.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run_cmd = sub.add_parser("run", help="fill LabMemberTemplate for a model (resumable)")
+    run_cmd.add_argument("model")
+    run_cmd.add_argument("--workers", type=int, default=WORKERS, help="image loader threads")
+    run_cmd.add_argument("--batch", type=int, default=BATCH_SIZE, help="faces per forward pass")
+    run_cmd.add_argument("--fast", action="store_true", help="the cascade's first-stage templates")
+    status_cmd = sub.add_parser("status", help="how many members have a template for a model")
+    status_cmd.add_argument("model")
+    status_cmd.add_argument("--fast", action="store_true", help="the cascade's first-stage templates")
+    shadow_cmd = sub.add_parser("shadow", help="score live scans with a candidate model too")
+    shadow_cmd.add_argument("model", nargs="?")
+    shadow_cmd.add_argument("--off", action="store_true")
+    activate_cmd = sub.add_parser("activate", help="switch LabMember templates to a model")
+    activate_cmd.add_argument("model")
+    activate_cmd.add_argument("--force", action="store_true", help="activate even if some members are missing")
+    args = parser.parse_args()
+
+    conn = database.connect()
+    database.ensure_schema(conn)
+    if args.command == "run":
+        try:
+            done, failed = run(conn, args.model, args.workers, args.batch, fast=args.fast)
+        except RuntimeError as exc:
+            parser.error(str(exc))
+        print(f"[INFO] Embedded {done} members with {args.model}; {failed} without a usable image.")
+    elif args.command == "status":
+        key = args.model
+        if args.fast:
+            import facial_recognition as fr
+            key = fr.fast_model_name(args.model)
+        s = status(conn, key)
+        print(f"{key}: {s['done']}/{s['members']} members have a current template, {s['missing']} missing.")
+    elif args.command == "shadow":
+        if args.off == bool(args.model):
+            parser.error("give a model or --off")
+        config.save({"shadow_model": None if args.off else args.model})
+        print("[INFO] Shadow scoring " + ("disabled." if args.off else f"with {args.model}; restart the kiosks."))
+    else:
+        try:
+            previous = activate(conn, args.model, args.force)
+        except RuntimeError as exc:
+            parser.error(str(exc))
+        print(f"[INFO] Switched this node from {previous} to {args.model}; restart it to load the new weights.")
+        if not sync.is_replica(conn):
+            print("[INFO] Kiosks keep using their own model until 'reembed.py activate' is run on each.")
+            print("[INFO] Templates are float32; run template_codecs.py train-pq / convert to recompress.")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
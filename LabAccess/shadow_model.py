@@ -0,0 +1,122 @@
+"""Scores live scans with a candidate embedding model, off the scan path.
+
+While ``shadow_model`` is set in labaccess.json (``python reembed.py shadow
+MODEL``), every recognised face is also handed to a background thread that
+embeds it with the candidate model and matches it against that model's
+templates only. Members the re-embedding job has not reached yet are
+embedded from their image on first use; a kiosk has no images, so scans of
+members without a replicated template for the candidate are counted as not
+covered and left out of the comparison. The door decision never waits for
+the shadow: when the queue is full the scan is skipped and counted.
+
+The report compares the two models' decisions and latencies, so a model can
+be judged on real traffic before ``reembed.py activate`` switches to it.
+"""
+import queue
+import threading
+import time
+
+import numpy as np
+
+import template_codecs
+from database import DB_PATH
+from gallery_cache import GalleryCache
+
+QUEUE_SIZE = 8
+
+
+class ShadowScorer:
+    def __init__(self, model_name):
+        import facial_recognition as fr
+
+        self.fr = fr
+        self.model_name = model_name
+        self.model = fr.load_model(model_name)
+        self.gallery = GalleryCache(DB_PATH, self._make_template, model=model_name)
+        self.counts = {"agree": 0, "old_only": 0, "new_only": 0, "different_member": 0, "dropped": 0,
+                       "not_covered": 0}
+        self.old_time = 0.0
+        self.new_time = 0.0
+        self._queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="shadow-model", daemon=True)
+        self._thread.start()
+        print(f"[INFO] Shadow scoring live scans with {model_name}.")
+
+    def submit(self, face, lab_id, member_id, elapsed):
+        """Queues one scan; member_id is the live decision (None if denied)."""
+        try:
+            # copy: the crop is a view into a frame buffer that is about to be reused
+            self._queue.put_nowait((np.ascontiguousarray(face).copy(), lab_id, member_id, elapsed))
+        except queue.Full:
+            with self._lock:
+                self.counts["dropped"] += 1
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+        self.gallery.close()
+
+    def _make_template(self, blob):
+        face = self.fr.decode_face(blob)
+        if face is None:
+            return None
+        return template_codecs.encode_template(self.fr.embed_face(face, model=self.model))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            face, lab_id, old_member, old_elapsed = item
+            start = time.perf_counter()
+            member_ids, _, matrix = self.gallery.lab_embeddings(lab_id)
+            new_member = None
+            if old_member is not None and old_member not in member_ids:
+                # no candidate template for this member: a miss would say nothing about the model
+                with self._lock:
+                    self.counts["not_covered"] += 1
+                continue
+            if member_ids:
+                distances = matrix.distances(self.fr.embed_face(face, model=self.model))
+                # nearest member, as the live match_face grants
+                best = int(distances.argmin())
+                if distances[best] < self.fr.MATCH_THRESHOLD:
+                    new_member = member_ids[best]
+            elapsed = time.perf_counter() - start
+            self._record(lab_id, old_member, new_member, old_elapsed, elapsed)
+
+    def _record(self, lab_id, old_member, new_member, old_elapsed, new_elapsed):
+        if old_member == new_member:
+            outcome = "agree"
+        elif new_member is None:
+            outcome = "old_only"
+        elif old_member is None:
+            outcome = "new_only"
+        else:
+            outcome = "different_member"
+        with self._lock:
+            self.counts[outcome] += 1
+            self.old_time += old_elapsed
+            self.new_time += new_elapsed
+        if outcome != "agree":
+            print(f"[INFO] Shadow disagreement in lab {lab_id}: live={old_member} {self.model_name}={new_member}")
+
+    def report(self):
+        with self._lock:
+            scored = sum(v for k, v in self.counts.items() if k not in ("dropped", "not_covered"))
+            return {
+                **self.counts,
+                "scored": scored,
+                "disagreement": (scored - self.counts["agree"]) / scored if scored else 0.0,
+                "old_ms": 1000 * self.old_time / scored if scored else 0.0,
+                "new_ms": 1000 * self.new_time / scored if scored else 0.0,
+            }
+
+    def print_report(self):
+        r = self.report()
+        print(f"[INFO] Shadow {self.model_name}: {r['scored']} scans scored, {r['dropped']} skipped, "
+              f"{r['not_covered']} without a {self.model_name} template; "
+              f"disagreement {r['disagreement']:.1%} (granted only live {r['old_only']}, "
+              f"only {self.model_name} {r['new_only']}, different member {r['different_member']}); "
+              f"match time live {r['old_ms']:.1f} ms vs {r['new_ms']:.1f} ms")
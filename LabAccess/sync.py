@@ -0,0 +1,396 @@
+"""Delta replication between a central database and kiosk nodes.
+
+The central node records every insert, update and delete on Lab, LabMember
+and TemplateCodebook in a ChangeLog table (filled by triggers), numbered by a
+monotonically increasing ``seq``. A kiosk remembers the last seq it applied
+and pulls only what changed since, collapsed to the latest state of each row:
+names, lab bindings, templates and image references, never the images
+themselves. Kiosks push their LabAccess rows back in batches. If the central
+node is unreachable the kiosk keeps working from its local copy and catches
+up on the next successful sync.
+
+Enroll members on the central node; the kiosk copies are replicas.
+
+The TCP server hands out every member's name and face template and accepts
+access events, so it only answers kiosks registered with ``add-kiosk``: each
+request carries the kiosk id and its token, and central stores only a hash of
+the token. It listens on 127.0.0.1 unless --host names another interface.
+Tokens and templates travel unencrypted, so expose the port only on the
+kiosk network or through a VPN/TLS tunnel.
+
+    python sync.py init-central --db central.db
+    python sync.py add-kiosk --db central.db door-1          # prints door-1's token
+    python sync.py serve --db central.db --host 10.0.0.5 --port 8765
+    python sync.py kiosk --kiosk-id door-1 --token TOKEN --central 10.0.0.5:8765
+    python sync.py kiosk --kiosk-id door-1 --central-db //server/share/central.db
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import socket
+import socketserver
+import sqlite3
+import time
+
+import database
+
+SYNC_TABLES = {
+    "Lab": ("lab_id", ["lab_id", "lab_name", "building", "room"]),
+    "LabMember": ("member_id", ["member_id", "first_name", "last_name", "lab_id", "face_template",
+                                "template_model", "face_ref"]),
+    "TemplateCodebook": ("codebook_id", ["codebook_id", "created", "data"]),
+    # keyed by (member_id, model); replicated by rowid and applied with INSERT OR REPLACE
+    "LabMemberTemplate": ("rowid", ["rowid", "member_id", "model", "template", "face_ref", "created"]),
+}
+PULL_LIMIT = 500     # rows per delta
+PUSH_BATCH = 500     # access events per push
+SYNC_INTERVAL = 30   # seconds between kiosk sync attempts
+PORT = 8765
+HOST = "127.0.0.1"
+TOKEN_ENV = "LABACCESS_SYNC_TOKEN"
+
+
+# ---------- value encoding ----------
+
+def _encode(value):
+    if isinstance(value, bytes):
+        return {"b64": base64.b64encode(value).decode("ascii")}
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict):
+        return base64.b64decode(value["b64"])
+    return value
+
+
+# ---------- central node ----------
+
+def install_change_log(conn):
+    """Creates the ChangeLog table and its triggers on the central database."""
+    database.ensure_schema(conn)
+    conn.execute("CREATE TABLE IF NOT EXISTS ChangeLog (seq INTEGER PRIMARY KEY AUTOINCREMENT, table_name TEXT, row_id INTEGER)")
+    fresh = conn.execute("SELECT COUNT(*) FROM ChangeLog").fetchone()[0] == 0
+    for table, (key, _) in SYNC_TABLES.items():
+        logged = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = ?", (f"{table}_insert_log",)
+        ).fetchone()
+        if fresh or not logged:
+            # log rows that existed before the triggers so kiosks receive them
+            conn.execute(f"INSERT INTO ChangeLog (table_name, row_id) SELECT '{table}', {key} FROM {table}")
+        for event, ref in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+            conn.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_log AFTER {event} ON {table} "
+                f"BEGIN INSERT INTO ChangeLog (table_name, row_id) VALUES ('{table}', {ref}.{key}); END"
+            )
+    database.add_missing_columns(conn.cursor(), "LabAccess", {"origin": "TEXT", "origin_id": "INTEGER"})
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS LabAccess_origin ON LabAccess (origin, origin_id)")
+    conn.execute("CREATE TABLE IF NOT EXISTS SyncKiosk (kiosk_id TEXT PRIMARY KEY, token_hash TEXT)")
+    conn.commit()
+
+
+class CentralNode:
+    """Answers kiosk pulls and pushes against the central database."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def pull(self, since, limit=PULL_LIMIT):
+        """Returns {"seq": newest seq included, "changes": [...]} after since."""
+        rows = self.conn.execute(
+            "SELECT table_name, row_id, MAX(seq) AS last FROM ChangeLog WHERE seq > ? "
+            "GROUP BY table_name, row_id ORDER BY last LIMIT ?",
+            (since, limit),
+        ).fetchall()
+        changes = []
+        for table, row_id, _ in rows:
+            key, columns = SYNC_TABLES[table]
+            row = self.conn.execute(
+                f"SELECT {', '.join(columns)} FROM {table} WHERE {key} = ?", (row_id,)
+            ).fetchone()
+            changes.append({
+                "table": table,
+                "id": row_id,
+                "row": None if row is None else [_encode(v) for v in row],
+            })
+        # only as far as the rows actually read: a change committed after the
+        # query above gets a later seq and goes out with the next pull
+        newest = rows[-1][2] if rows else since
+        return {"seq": newest, "changes": changes}
+
+    def push(self, kiosk_id, events):
+        """Stores access events from a kiosk; re-sent events are ignored."""
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO LabAccess (origin, origin_id, member_id, lab_id, time_stamp, access_type, result) "
+            "VALUES (?,?,?,?,?,?,?)",
+            [(kiosk_id, *event) for event in events],
+        )
+        self.conn.commit()
+        return {"stored": len(events)}
+
+
+def _hash_token(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def add_kiosk(conn, kiosk_id):
+    """Registers (or re-keys) a kiosk; returns its new token."""
+    install_change_log(conn)
+    token = secrets.token_urlsafe(32)
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO SyncKiosk (kiosk_id, token_hash) VALUES (?, ?)",
+                     (kiosk_id, _hash_token(token)))
+    return token
+
+
+def authenticate(conn, kiosk_id, token) -> bool:
+    row = conn.execute("SELECT token_hash FROM SyncKiosk WHERE kiosk_id = ?", (kiosk_id,)).fetchone()
+    # compare hashes even for unknown kiosks so timing reveals nothing
+    expected = row[0] if row else _hash_token(secrets.token_urlsafe(32))
+    return row is not None and isinstance(token, str) and hmac.compare_digest(expected, _hash_token(token))
+
+
+class FileTransport:
+    """Talks to a central database file directly (shared drive or test stand-in)."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    def _call(self, method, *args):
+        try:
+            # mode=rw so an unmounted share is an error, not a new empty database
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=rw", uri=True, timeout=10)
+        except sqlite3.OperationalError as exc:
+            raise ConnectionError(f"{self.db_path}: {exc}") from exc
+        try:
+            return getattr(CentralNode(conn), method)(*args)
+        except sqlite3.OperationalError as exc:
+            raise ConnectionError(str(exc)) from exc
+        finally:
+            conn.close()
+
+    def pull(self, since, limit=PULL_LIMIT):
+        return self._call("pull", since, limit)
+
+    def push(self, kiosk_id, events):
+        return self._call("push", kiosk_id, events)
+
+
+class SocketTransport:
+    """Sends one authenticated JSON request per connection to ``sync.py serve``."""
+
+    def __init__(self, host, port, kiosk_id, token, timeout=10):
+        self.address = (host, port)
+        self.kiosk_id = kiosk_id
+        self.token = token
+        self.timeout = timeout
+
+    def _request(self, payload):
+        payload = {**payload, "kiosk_id": self.kiosk_id, "token": self.token}
+        with socket.create_connection(self.address, timeout=self.timeout) as sock:
+            sock.sendall(json.dumps(payload).encode() + b"\n")
+            with sock.makefile("rb") as f:
+                line = f.readline()
+        if not line:
+            raise ConnectionError("central node closed the connection")
+        reply = json.loads(line)
+        if "error" in reply:
+            raise ConnectionError(reply["error"])
+        return reply
+
+    def pull(self, since, limit=PULL_LIMIT):
+        return self._request({"op": "pull", "since": since, "limit": limit})
+
+    def push(self, kiosk_id, events):
+        return self._request({"op": "push", "events": events})
+
+
+class _SyncHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        conn = sqlite3.connect(self.server.db_path, timeout=10)
+        try:
+            node = CentralNode(conn)
+            kiosk_id = request.get("kiosk_id")
+            if not authenticate(conn, kiosk_id, request.get("token")):
+                print(f"[WARN] Rejected sync request from {self.client_address[0]} as {kiosk_id!r}.")
+                reply = {"error": "unknown kiosk or wrong token"}
+            elif request["op"] == "pull":
+                reply = node.pull(request["since"], request.get("limit", PULL_LIMIT))
+            elif request["op"] == "push":
+                # events are filed under the authenticated kiosk, never a claimed one
+                reply = node.push(kiosk_id, request["events"])
+            else:
+                reply = {"error": f"unknown op {request['op']!r}"}
+        except Exception as exc:
+            reply = {"error": repr(exc)}
+        finally:
+            conn.close()
+        self.wfile.write(json.dumps(reply).encode() + b"\n")
+
+
+def serve(db_path, host=HOST, port=PORT):
+    conn = sqlite3.connect(db_path)
+    install_change_log(conn)
+    kiosks = conn.execute("SELECT COUNT(*) FROM SyncKiosk").fetchone()[0]
+    conn.close()
+    if not kiosks:
+        print("[WARN] No kiosks registered; run 'sync.py add-kiosk' first.")
+    with socketserver.ThreadingTCPServer((host, port), _SyncHandler) as server:
+        server.db_path = db_path
+        print(f"[INFO] Serving {db_path} on {host}:{port} to {kiosks} kiosks.")
+        server.serve_forever()
+
+
+# ---------- kiosk node ----------
+
+def is_replica(conn) -> bool:
+    """True for a kiosk database kept in sync by KioskSync.
+
+    Its LabMember rows belong to central: a local insert would take a
+    member_id that central later assigns to someone else, and a local edit
+    is overwritten by the next pull.
+    """
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'SyncState'").fetchone() is not None
+
+
+class KioskSync:
+    def __init__(self, conn, transport, kiosk_id):
+        self.conn = conn
+        self.transport = transport
+        self.kiosk_id = kiosk_id
+        database.ensure_schema(conn)
+        conn.execute("CREATE TABLE IF NOT EXISTS SyncState (key TEXT PRIMARY KEY, value INTEGER)")
+        conn.commit()
+
+    def sync_once(self) -> bool:
+        """Pulls all pending changes and pushes unsent events; False if offline."""
+        try:
+            pulled = self.pull()
+            pushed = self.push()
+        except (OSError, ConnectionError, ValueError) as exc:
+            print(f"[WARN] Sync with central node failed, working offline: {exc}")
+            return False
+        if pulled or pushed:
+            print(f"[INFO] Sync: applied {pulled} changes, pushed {pushed} access events.")
+        return True
+
+    def pull(self):
+        applied = 0
+        while True:
+            since = self._state("last_seq")
+            delta = self.transport.pull(since)
+            with self.conn:
+                for change in delta["changes"]:
+                    self._apply(change)
+                self._set_state("last_seq", delta["seq"])
+            applied += len(delta["changes"])
+            if len(delta["changes"]) < PULL_LIMIT:
+                return applied
+
+    def push(self):
+        pushed = 0
+        while True:
+            last = self._state("last_pushed_access")
+            rows = self.conn.execute(
+                "SELECT accessID, member_id, lab_id, time_stamp, access_type, result FROM LabAccess "
+                "WHERE accessID > ? ORDER BY accessID LIMIT ?",
+                (last, PUSH_BATCH),
+            ).fetchall()
+            if not rows:
+                return pushed
+            self.transport.push(self.kiosk_id, [list(row) for row in rows])
+            with self.conn:
+                self._set_state("last_pushed_access", rows[-1][0])
+            pushed += len(rows)
+
+    def run_forever(self, interval=SYNC_INTERVAL):
+        while True:
+            self.sync_once()
+            time.sleep(interval)
+
+    def _apply(self, change):
+        table = change["table"]
+        key, columns = SYNC_TABLES[table]
+        if change["row"] is None:
+            self.conn.execute(f"DELETE FROM {table} WHERE {key} = ?", (change["id"],))
+            return
+        values = [_decode(v) for v in change["row"]]
+        if key == "rowid":
+            # replaces the row holding the same natural key under an older rowid
+            self.conn.execute(
+                f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                values,
+            )
+            return
+        updates = ", ".join(f"{col} = excluded.{col}" for col in columns if col != key)
+        self.conn.execute(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+            f"ON CONFLICT({key}) DO UPDATE SET {updates}",
+            values,
+        )
+
+    def _state(self, key):
+        row = self.conn.execute("SELECT value FROM SyncState WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def _set_state(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO SyncState (key, value) VALUES (?, ?)", (key, value))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replicate the member gallery between central and kiosks.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    init = sub.add_parser("init-central", help="install the change log on the central database")
+    init.add_argument("--db", required=True)
+    add = sub.add_parser("add-kiosk", help="register a kiosk and print its token")
+    add.add_argument("--db", required=True)
+    add.add_argument("kiosk_id")
+    srv = sub.add_parser("serve", help="serve the central database over TCP")
+    srv.add_argument("--db", required=True)
+    srv.add_argument("--host", default=HOST, help="interface to listen on")
+    srv.add_argument("--port", type=int, default=PORT)
+    kiosk = sub.add_parser("kiosk", help="keep this kiosk's database in sync")
+    kiosk.add_argument("--kiosk-id", required=True)
+    source = kiosk.add_mutually_exclusive_group(required=True)
+    source.add_argument("--central", help="HOST:PORT of a sync.py serve process")
+    source.add_argument("--central-db", help="path to the central database file")
+    kiosk.add_argument("--token", default=os.environ.get(TOKEN_ENV),
+                       help=f"token from add-kiosk (default: ${TOKEN_ENV})")
+    kiosk.add_argument("--db", default=database.DB_PATH, help="local kiosk database")
+    kiosk.add_argument("--interval", type=float, default=SYNC_INTERVAL)
+    kiosk.add_argument("--once", action="store_true", help="sync once and exit")
+    args = parser.parse_args()
+
+    if args.command == "init-central":
+        conn = sqlite3.connect(args.db)
+        install_change_log(conn)
+        conn.close()
+    elif args.command == "add-kiosk":
+        conn = sqlite3.connect(args.db)
+        token = add_kiosk(conn, args.kiosk_id)
+        conn.close()
+        print(f"[INFO] Token for {args.kiosk_id} (shown once): {token}")
+    elif args.command == "serve":
+        serve(args.db, args.host, args.port)
+    else:
+        if args.central:
+            if not args.token:
+                parser.error(f"--central needs --token or ${TOKEN_ENV}")
+            host, _, port = args.central.rpartition(":")
+            transport = SocketTransport(host, int(port), args.kiosk_id, args.token)
+        else:
+            transport = FileTransport(args.central_db)
+        node = KioskSync(sqlite3.connect(args.db), transport, args.kiosk_id)
+        if args.once:
+            node.sync_once()
+        else:
+            node.run_forever(args.interval)
+
+
+if __name__ == "__main__":
+    main()
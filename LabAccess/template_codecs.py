@@ -0,0 +1,336 @@
+"""Compact storage formats for face templates (precomputed embeddings).
+
+A template blob is one format tag byte followed by the payload:
+
+    float32  512 x float32                       2048 bytes
+    float16  512 x float16                       1024 bytes
+    int8     float32 scale + 512 x int8           516 bytes
+    pq       uint32 codebook_id + 64 x uint8       68 bytes
+
+Product quantization (pq) splits the vector into 64 sub-vectors of 8 values
+and stores, for each, the index of the nearest of 256 trained centroids. The
+codebooks live in the TemplateCodebook table.
+
+TemplateMatrix stacks a lab's templates in their compressed form and computes
+distances to a query embedding without decompressing the whole gallery:
+float16/int8 rows are widened a block at a time and pq uses per-query lookup
+tables (asymmetric distance).
+
+    python template_codecs.py report          # accuracy of each format vs float32
+    python template_codecs.py train-pq        # train and store a pq codebook
+    python template_codecs.py convert int8    # re-encode every LabMember template
+"""
+import argparse
+import struct
+from datetime import datetime
+
+import numpy as np
+
+import database
+from face_store import load_member_image
+
+FORMATS = ("float32", "float16", "int8", "pq")
+_TAGS = {name: tag for tag, name in enumerate(FORMATS)}
+
+EMBEDDING_SIZE = 512
+PQ_SUBSPACES = 64
+PQ_CENTROIDS = 256
+BLOCK_ROWS = 4096  # rows widened at once by the float16/int8 kernels
+
+
+# ---------- product quantization ----------
+
+class Codebook:
+    """Per-subspace centroids, shape (subspaces, centroids, sub_dim)."""
+
+    def __init__(self, codebook_id, centroids):
+        self.codebook_id = codebook_id
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+
+    @property
+    def subspaces(self):
+        return self.centroids.shape[0]
+
+    def encode(self, vector) -> np.ndarray:
+        sub = vector.reshape(self.subspaces, 1, -1)
+        return ((self.centroids - sub) ** 2).sum(axis=2).argmin(axis=1).astype(np.uint8)
+
+    def decode(self, codes) -> np.ndarray:
+        return self.centroids[np.arange(self.subspaces), codes].reshape(-1)
+
+    def distance_table(self, query) -> np.ndarray:
+        """Squared distances from each query sub-vector to every centroid."""
+        sub = query.reshape(self.subspaces, 1, -1)
+        return ((self.centroids - sub) ** 2).sum(axis=2)
+
+    def to_bytes(self) -> bytes:
+        return struct.pack("<3H", *self.centroids.shape) + self.centroids.tobytes()
+
+    @classmethod
+    def from_bytes(cls, codebook_id, data):
+        shape = struct.unpack_from("<3H", data)
+        centroids = np.frombuffer(data, dtype=np.float32, offset=6).reshape(shape)
+        return cls(codebook_id, centroids)
+
+
+def train_codebook(vectors, subspaces=PQ_SUBSPACES, centroids=PQ_CENTROIDS, iterations=20, seed=0):
+    """Runs k-means in every subspace; returns centroids for a Codebook."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    n, dim = vectors.shape
+    k = min(centroids, n)
+    rng = np.random.default_rng(seed)
+    result = np.zeros((subspaces, centroids, dim // subspaces), dtype=np.float32)
+    for m, sub in enumerate(np.split(vectors, subspaces, axis=1)):
+        centers = sub[rng.choice(n, k, replace=False)].copy()
+        for _ in range(iterations):
+            assign = ((sub[:, None, :] - centers[None]) ** 2).sum(axis=2).argmin(axis=1)
+            for c in range(k):
+                members = sub[assign == c]
+                if len(members):
+                    centers[c] = members.mean(axis=0)
+        result[m, :k] = centers
+        # unused slots repeat real centroids so every code decodes sensibly
+        result[m, k:] = centers[np.arange(centroids - k) % k]
+    return result
+
+
+def load_codebooks(conn):
+    rows = conn.execute("SELECT codebook_id, data FROM TemplateCodebook").fetchall()
+    return {codebook_id: Codebook.from_bytes(codebook_id, data) for codebook_id, data in rows}
+
+
+def save_codebook(conn, centroids) -> Codebook:
+    cursor = conn.execute(
+        "INSERT INTO TemplateCodebook (created, data) VALUES (?, ?)",
+        (datetime.now().isoformat(timespec="seconds"), Codebook(None, centroids).to_bytes()),
+    )
+    conn.commit()
+    return Codebook(cursor.lastrowid, centroids)
+
+
+# ---------- encoding ----------
+
+def template_format(blob) -> str:
+    return FORMATS[blob[0]]
+
+
+def encode_template(vector, fmt="float32", codebook=None) -> bytes:
+    vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+    tag = bytes([_TAGS[fmt]])
+    if fmt == "float32":
+        return tag + vector.tobytes()
+    if fmt == "float16":
+        return tag + vector.astype(np.float16).tobytes()
+    if fmt == "int8":
+        scale = float(np.abs(vector).max()) / 127 or 1.0
+        codes = np.clip(np.rint(vector / scale), -127, 127).astype(np.int8)
+        return tag + struct.pack("<f", scale) + codes.tobytes()
+    if fmt == "pq":
+        if codebook is None:
+            raise ValueError("pq templates need a trained codebook")
+        return tag + struct.pack("<I", codebook.codebook_id) + codebook.encode(vector).tobytes()
+    raise ValueError(f"unknown template format {fmt!r}")
+
+
+def decode_template(blob, codebooks=None) -> np.ndarray:
+    fmt = template_format(blob)
+    if fmt == "float32":
+        return np.frombuffer(blob, dtype=np.float32, offset=1).copy()
+    if fmt == "float16":
+        return np.frombuffer(blob, dtype=np.float16, offset=1).astype(np.float32)
+    if fmt == "int8":
+        (scale,) = struct.unpack_from("<f", blob, 1)
+        return np.frombuffer(blob, dtype=np.int8, offset=5).astype(np.float32) * scale
+    (codebook_id,) = struct.unpack_from("<I", blob, 1)
+    return codebooks[codebook_id].decode(np.frombuffer(blob, dtype=np.uint8, offset=5))
+
+
+# ---------- distance kernels ----------
+
+class TemplateMatrix:
+    """A gallery of encoded templates that can be searched without decoding."""
+
+    def __init__(self, blobs, codebooks=None):
+        self.size = len(blobs)
+        self._groups = []  # (format, row indices, packed data)
+        by_format = {}
+        for idx, blob in enumerate(blobs):
+            by_format.setdefault(template_format(blob), []).append(idx)
+        for fmt, rows in by_format.items():
+            self._groups.append((fmt, np.array(rows), self._pack(fmt, [blobs[i] for i in rows], codebooks)))
+
+    def __len__(self):
+        return self.size
+
+    @staticmethod
+    def _pack(fmt, blobs, codebooks):
+        if fmt in ("float32", "float16"):
+            dtype = np.float32 if fmt == "float32" else np.float16
+            matrix = np.stack([np.frombuffer(b, dtype=dtype, offset=1) for b in blobs])
+            sq_norms = np.einsum("ij,ij->i", matrix, matrix, dtype=np.float32)
+            return matrix, sq_norms
+        if fmt == "int8":
+            scales = np.array([struct.unpack_from("<f", b, 1)[0] for b in blobs], dtype=np.float32)
+            codes = np.stack([np.frombuffer(b, dtype=np.int8, offset=5) for b in blobs])
+            sq_norms = np.einsum("ij,ij->i", codes, codes, dtype=np.float32) * scales ** 2
+            return codes, scales, sq_norms
+        by_codebook = {}
+        for idx, blob in enumerate(blobs):
+            (codebook_id,) = struct.unpack_from("<I", blob, 1)
+            by_codebook.setdefault(codebook_id, []).append(idx)
+        return [
+            (codebooks[cid], np.array(idx), np.stack([np.frombuffer(blobs[i], dtype=np.uint8, offset=5) for i in idx]))
+            for cid, idx in by_codebook.items()
+        ]
+
+    def distances(self, query) -> np.ndarray:
+        """Euclidean distance from query to every template, in input order."""
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        q_norm = float(query @ query)
+        out = np.empty(self.size, dtype=np.float32)
+        for fmt, rows, packed in self._groups:
+            if fmt in ("float32", "float16"):
+                matrix, sq_norms = packed
+                dots = _blocked_dot(matrix, query)
+                sq = q_norm - 2 * dots + sq_norms
+            elif fmt == "int8":
+                codes, scales, sq_norms = packed
+                sq = q_norm - 2 * scales * _blocked_dot(codes, query) + sq_norms
+            else:
+                sq = np.empty(len(rows), dtype=np.float32)
+                for codebook, idx, codes in packed:
+                    table = codebook.distance_table(query)
+                    sq[idx] = table[np.arange(codebook.subspaces), codes].sum(axis=1)
+            out[rows] = np.sqrt(np.maximum(sq, 0))
+        return out
+
+
+def _blocked_dot(matrix, query):
+    if matrix.dtype == np.float32:
+        return matrix @ query
+    dots = np.empty(len(matrix), dtype=np.float32)
+    for start in range(0, len(matrix), BLOCK_ROWS):
+        block = matrix[start:start + BLOCK_ROWS].astype(np.float32)
+        dots[start:start + BLOCK_ROWS] = block @ query
+    return dots
+
+
+# ---------- accuracy report ----------
+
+def accuracy_report(vectors, threshold, formats=FORMATS):
+    """Compares each format's match decisions with float32 over all pairs.
+
+    The pq codebook is trained on the same vectors, so its numbers are an
+    optimistic estimate for small galleries.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    n = len(vectors)
+    upper = np.triu_indices(n, k=1)
+    reference = TemplateMatrix([encode_template(v) for v in vectors])
+    ref = np.stack([reference.distances(v) for v in vectors])[upper]
+    ref_match = ref < threshold
+
+    report = []
+    for fmt in formats:
+        codebooks = None
+        codebook = None
+        if fmt == "pq":
+            codebook = Codebook(0, train_codebook(vectors))
+            codebooks = {0: codebook}
+        blobs = [encode_template(v, fmt, codebook) for v in vectors]
+        matrix = TemplateMatrix(blobs, codebooks)
+        # queries stay float32: only the stored side is compressed
+        dist = np.stack([matrix.distances(v) for v in vectors])[upper]
+        match = dist < threshold
+        report.append({
+            "format": fmt,
+            "bytes": len(blobs[0]),
+            "pairs": len(ref),
+            "agreement": float((match == ref_match).mean()) if len(ref) else 1.0,
+            "extra_accepts": int((match & ~ref_match).sum()),
+            "extra_rejects": int((~match & ref_match).sum()),
+            "mean_abs_error": float(np.abs(dist - ref).mean()) if len(ref) else 0.0,
+        })
+    return report
+
+
+def print_report(report, threshold):
+    print(f"Match decisions vs float32 at threshold {threshold}:")
+    print(f"{'format':<8} {'bytes':>6} {'pairs':>8} {'agree':>8} {'+accept':>8} {'+reject':>8} {'|err|':>8}")
+    for row in report:
+        print(f"{row['format']:<8} {row['bytes']:>6} {row['pairs']:>8} {row['agreement']:>8.2%} "
+              f"{row['extra_accepts']:>8} {row['extra_rejects']:>8} {row['mean_abs_error']:>8.4f}")
+
+
+# ---------- command line ----------
+
+def _member_vectors(conn, codebooks):
+    """float32 embeddings for every member, from templates or their images."""
+    import facial_recognition as fr
+
+    ids, vectors = [], []
+    rows = conn.execute("SELECT member_id, face_template, face_ref FROM LabMember").fetchall()
+    for member_id, template, face_ref in rows:
+        vector = decode_template(template, codebooks) if template else None
+        image = load_member_image(conn, member_id, face_ref) if vector is None else None
+        if image is not None:
+            vector = fr.embed_blob(image)
+        if vector is not None:
+            ids.append(member_id)
+            vectors.append(vector)
+    return ids, vectors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Face template storage formats.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    report = sub.add_parser("report", help="compare match decisions of every format with float32")
+    report.add_argument("--from-images", action="store_true",
+                        help="re-embed the enrollment images instead of decoding stored templates")
+    sub.add_parser("train-pq", help="train a pq codebook on the stored templates")
+    convert = sub.add_parser("convert", help="re-encode every LabMember template")
+    convert.add_argument("format", choices=FORMATS)
+    args = parser.parse_args()
+
+    import facial_recognition as fr
+
+    conn = database.connect()
+    database.ensure_schema(conn)
+    codebooks = load_codebooks(conn)
+
+    if args.command == "report":
+        if args.from_images:
+            rows = conn.execute("SELECT member_id, face_ref FROM LabMember").fetchall()
+            images = [load_member_image(conn, *row) for row in rows]
+            vectors = [v for v in (fr.embed_blob(b) for b in images if b is not None) if v is not None]
+        else:
+            _, vectors = _member_vectors(conn, codebooks)
+        if len(vectors) < 2:
+            parser.error("need at least two enrolled faces")
+        print_report(accuracy_report(vectors, fr.MATCH_THRESHOLD), fr.MATCH_THRESHOLD)
+
+    elif args.command == "train-pq":
+        _, vectors = _member_vectors(conn, codebooks)
+        if not vectors:
+            parser.error("no enrolled faces to train on")
+        codebook = save_codebook(conn, train_codebook(vectors))
+        print(f"[INFO] Stored pq codebook {codebook.codebook_id} trained on {len(vectors)} templates.")
+
+    elif args.command == "convert":
+        codebook = codebooks[max(codebooks)] if codebooks else None
+        if args.format == "pq" and codebook is None:
+            parser.error("run train-pq first")
+        ids, vectors = _member_vectors(conn, codebooks)
+        conn.executemany(
+            # vectors embedded from an image come from the active model
+            "UPDATE LabMember SET face_template = ?, template_model = COALESCE(template_model, ?) WHERE member_id = ?",
+            [(encode_template(v, args.format, codebook), fr.MODEL_NAME, member_id) for member_id, v in zip(ids, vectors)],
+        )
+        conn.commit()
+        print(f"[INFO] Re-encoded {len(ids)} templates as {args.format}.")
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+import access_log
+import database
+import sync
+
+OLD = datetime.now() - timedelta(days=200)
+
+
+class AccessLogTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp, "kiosk.db")
+        self.archive_dir = os.path.join(self.tmp, "archive")
+        self.conn = sqlite3.connect(self.db_path)
+        database.ensure_schema(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+        access_log._connection(self.db_path).close()
+        del access_log._local.conns[self.db_path]
+        shutil.rmtree(self.tmp)
+
+    def log(self, member_id, granted, when):
+        return access_log.log_scan(1, member_id, granted, when=when, db_path=self.db_path)
+
+    def test_rollups_count_every_scan(self):
+        self.log(7, True, datetime(2024, 5, 1, 9, 15))
+        self.log(7, True, datetime(2024, 5, 1, 9, 45))
+        self.log(None, False, datetime(2024, 5, 1, 10, 5))
+        self.assertEqual(access_log.rollups(self.conn, "day"),
+                         [("2024-05-01", 1, 0, 0, 1), ("2024-05-01", 1, 7, 2, 0)])
+        self.assertEqual(access_log.rollups(self.conn, "hour", since="2024-05-01 10"),
+                         [("2024-05-01 10", 1, 0, 0, 1)])
+
+    def test_compact_moves_old_rows_and_history_reads_them_back(self):
+        for days in (200, 150, 1):
+            self.log(7, True, datetime.now() - timedelta(days=days))
+        moved = access_log.compact(self.conn, 90, archive_dir=self.archive_dir)
+
+        self.assertEqual(moved, 2)
+        self.assertEqual(self.conn.execute("SELECT accessID FROM LabAccess").fetchall(), [(3,)])
+        ids = [row[0] for row in access_log.history(self.conn, archive_dir=self.archive_dir)]
+        self.assertEqual(ids, [1, 2, 3])
+        totals = sum(row[3] for row in access_log.rollups(self.conn, "day"))
+        self.assertEqual(totals, 3)
+
+    def test_compact_keeps_the_newest_row(self):
+        for _ in range(3):
+            self.log(7, True, OLD)
+        access_log.compact(self.conn, 90, archive_dir=self.archive_dir)
+        self.assertEqual(self.conn.execute("SELECT accessID FROM LabAccess").fetchall(), [(3,)])
+        self.assertEqual(self.log(7, True, datetime.now()), 4)
+
+
+class CompactThenPushTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.central_path = os.path.join(self.tmp, "central.db")
+        self.kiosk_path = os.path.join(self.tmp, "kiosk.db")
+        central = sqlite3.connect(self.central_path)
+        sync.install_change_log(central)
+        central.close()
+        self.kiosk = sqlite3.connect(self.kiosk_path)
+        self.replica = sync.KioskSync(self.kiosk, sync.FileTransport(self.central_path), "door-1")
+
+    def tearDown(self):
+        self.kiosk.close()
+        access_log._connection(self.kiosk_path).close()
+        del access_log._local.conns[self.kiosk_path]
+        shutil.rmtree(self.tmp)
+
+    def test_scan_after_a_quiet_retention_window_reaches_central(self):
+        for _ in range(3):
+            access_log.log_scan(1, 7, True, when=OLD, db_path=self.kiosk_path)
+        self.assertEqual(self.replica.push(), 3)
+        access_log.compact(self.kiosk, 90, archive_dir=os.path.join(self.tmp, "archive"))
+
+        access_log.log_scan(1, 7, True, db_path=self.kiosk_path)
+        self.assertEqual(self.replica.push(), 1)
+        central = sqlite3.connect(self.central_path)
+        self.assertEqual(central.execute("SELECT COUNT(*) FROM LabAccess").fetchone()[0], 4)
+        central.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+import access_log
+import database
+from lab_directory import LabDirectory
+
+try:
+    import numpy as np
+    import template_codecs
+    from gallery_cache import GalleryCache
+except ImportError:  # needs numpy
+    np = None
+
+
+class _CatalogTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp, "test.db")
+        self.conn = sqlite3.connect(self.db_path)
+        database.ensure_schema(self.conn)
+        self.conn.execute("INSERT INTO Lab (lab_id, lab_name) VALUES (1, 'Theory')")
+        self.conn.commit()
+
+    def tearDown(self):
+        self.conn.close()
+        conns = getattr(access_log._local, "conns", {})
+        if self.db_path in conns:
+            conns.pop(self.db_path).close()
+        shutil.rmtree(self.tmp)
+
+    def log_scan(self):
+        access_log.log_scan(1, 1, True, db_path=self.db_path)
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class GalleryCacheVersionTest(_CatalogTest):
+    def setUp(self):
+        super().setUp()
+        template = template_codecs.encode_template(np.ones(512, dtype=np.float32) / np.sqrt(512))
+        self.conn.execute(
+            "INSERT INTO LabMember (member_id, first_name, lab_id, face_template) VALUES (1, 'Ada', 1, ?)",
+            (template,),
+        )
+        self.conn.commit()
+        self.cache = GalleryCache(self.db_path, lambda blob: None)
+        self.cache.lab_embeddings(1)
+
+    def tearDown(self):
+        self.cache.close()
+        super().tearDown()
+
+    def test_logged_scans_do_not_resync(self):
+        with mock.patch.object(self.cache, "_resync_lab") as resync:
+            self.log_scan()
+            self.cache.lab_embeddings(1)
+        resync.assert_not_called()
+
+    def test_member_edits_still_resync(self):
+        self.log_scan()
+        self.conn.execute("UPDATE LabMember SET first_name = 'Grace' WHERE member_id = 1")
+        self.conn.commit()
+        self.assertEqual(self.cache.lab_embeddings(1)[1], ["Grace"])
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class StoreBuiltTest(_CatalogTest):
+    def setUp(self):
+        super().setUp()
+        # a legacy member: the image is inline and there is no template for the model
+        self.conn.execute(
+            "INSERT INTO LabMember (member_id, first_name, lab_id, facial_id) VALUES (1, 'Ada', 1, ?)", (b"face",)
+        )
+        self.conn.commit()
+        self.built = []
+
+    def make_template(self, blob):
+        self.built.append(blob)
+        return template_codecs.encode_template(np.ones(512, dtype=np.float32) / np.sqrt(512))
+
+    def test_built_templates_are_stored_and_reused(self):
+        for _ in range(2):
+            cache = GalleryCache(self.db_path, self.make_template, model="fast", store_built=True)
+            self.assertEqual(cache.lab_embeddings(1)[1], ["Ada"])
+            cache.close()
+        self.assertEqual(self.built, [b"face"])
+        rows = self.conn.execute("SELECT member_id, model FROM LabMemberTemplate").fetchall()
+        self.assertEqual(rows, [(1, "fast")])
+
+
+class LabDirectoryVersionTest(_CatalogTest):
+    def setUp(self):
+        super().setUp()
+        self.labs = LabDirectory(self.db_path)
+        self.labs.load()
+
+    def tearDown(self):
+        self.labs.close()
+        super().tearDown()
+
+    def test_logged_scans_do_not_reload(self):
+        with mock.patch.object(self.labs, "load") as load:
+            self.log_scan()
+            self.assertIsNotNone(self.labs.get(1))
+        load.assert_not_called()
+
+    def test_new_labs_are_picked_up(self):
+        self.log_scan()
+        self.conn.execute("INSERT INTO Lab (lab_id, lab_name) VALUES (2, 'AI')")
+        self.conn.commit()
+        self.assertEqual(self.labs.find("ai").lab_id, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import time
+import unittest
+from unittest import mock
+
+try:
+    import numpy as np
+    import inference_pool
+except ImportError:  # needs numpy
+    inference_pool = None
+
+
+class _DeadProcess:
+    exitcode = 1
+
+    def is_alive(self):
+        return False
+
+
+class _Tasks:
+    def put(self, item):
+        pass
+
+
+@unittest.skipIf(inference_pool is None, "numpy is not installed")
+class SupervisorTest(unittest.TestCase):
+    def test_workers_that_die_on_startup_are_given_up(self):
+        starts = []
+
+        def start_worker(pool, idx):
+            starts.append(time.monotonic())
+            pool._workers[idx] = (_DeadProcess(), _Tasks())
+            pool._started[idx] = time.monotonic()
+
+        with mock.patch.object(inference_pool.InferencePool, "_start_worker", start_worker), \
+                mock.patch.multiple(inference_pool, SUPERVISE_INTERVAL=0.001, RESTART_BACKOFF=0.001):
+            pool = inference_pool.InferencePool(size=1, max_frame_bytes=16, slots=1)
+            future = pool.submit(np.zeros((2, 2), dtype=np.uint8), lab_id=1)
+            deadline = time.monotonic() + 5
+            while pool.healthy and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertFalse(pool.healthy)
+            self.assertEqual(pool.restarts, inference_pool.MAX_RESTARTS)
+            # the wait before each restart grows
+            gaps = [b - a for a, b in zip(starts, starts[1:])]
+            self.assertGreater(gaps[-1], gaps[0])
+            with self.assertRaises(RuntimeError):
+                future.result(timeout=1)
+            with self.assertRaises(RuntimeError):
+                pool.submit(np.zeros((2, 2), dtype=np.uint8), lab_id=1)
+            pool.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+from unittest import mock
+
+try:
+    import numpy as np
+    import preview_renderer
+except ImportError:  # needs numpy, OpenCV and Pillow
+    preview_renderer = None
+
+
+class _Widget:
+    def config(self, **options):
+        self.options = options
+
+
+class _Photo:
+    """Stands in for ImageTk.PhotoImage, which needs a Tk display."""
+
+    def __init__(self, image):
+        self.pasted = []
+
+    def paste(self, image):
+        self.pasted.append(image.copy())
+
+
+@unittest.skipIf(preview_renderer is None, "numpy, OpenCV or Pillow is not installed")
+class TargetPaintTest(unittest.TestCase):
+    def test_painted_pixels_reach_the_photo(self):
+        with mock.patch.object(preview_renderer.ImageTk, "PhotoImage", _Photo):
+            target = preview_renderer._Target(_Widget(), (8, 6))
+        for bgr, rgb in (((0, 0, 255), (255, 0, 0)), ((255, 0, 0), (0, 0, 255))):
+            frame = np.empty((24, 32, 3), dtype=np.uint8)
+            frame[...] = bgr
+            target.paint(frame)
+            self.assertEqual(target.photo.pasted[-1].getpixel((0, 0))[:3], rgb)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+import os
+import socketserver
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+import sync
+
+
+class _RacingConnection:
+    """Commits a new Lab from another connection between pull's queries."""
+
+    def __init__(self, conn, db_path):
+        self.conn = conn
+        self.db_path = db_path
+        self.log_read = False
+        self.raced = False
+
+    def execute(self, sql, params=()):
+        if self.log_read and not self.raced:
+            self.raced = True
+            other = sqlite3.connect(self.db_path)
+            other.execute("INSERT INTO Lab (lab_name) VALUES ('Late')")
+            other.commit()
+            other.close()
+        self.log_read = self.log_read or "FROM ChangeLog" in sql
+        return self.conn.execute(sql, params)
+
+
+class CentralPullTest(unittest.TestCase):
+    def setUp(self):
+        handle, self.db_path = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+        self.conn = sqlite3.connect(self.db_path)
+        sync.install_change_log(self.conn)
+        self.conn.execute("INSERT INTO Lab (lab_name) VALUES ('First')")
+        self.conn.commit()
+
+    def tearDown(self):
+        self.conn.close()
+        os.remove(self.db_path)
+
+    def test_change_committed_during_pull_is_not_skipped(self):
+        node = sync.CentralNode(_RacingConnection(self.conn, self.db_path))
+        first = node.pull(0)
+        self.assertEqual([c["row"][1] for c in first["changes"]], ["First"])
+
+        second = sync.CentralNode(self.conn).pull(first["seq"])
+        self.assertEqual([c["row"][1] for c in second["changes"]], ["Late"])
+
+    def test_empty_pull_keeps_position(self):
+        node = sync.CentralNode(self.conn)
+        seq = node.pull(0)["seq"]
+        self.assertEqual(node.pull(seq), {"seq": seq, "changes": []})
+
+
+class SocketAuthTest(unittest.TestCase):
+    def setUp(self):
+        handle, self.db_path = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+        conn = sqlite3.connect(self.db_path)
+        self.token = sync.add_kiosk(conn, "door-1")
+        conn.close()
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), sync._SyncHandler)
+        self.server.db_path = self.db_path
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.port = self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        os.remove(self.db_path)
+
+    def test_registered_kiosk_can_pull(self):
+        transport = sync.SocketTransport("127.0.0.1", self.port, "door-1", self.token)
+        self.assertEqual(transport.pull(0)["changes"], [])
+
+    def test_wrong_token_is_rejected(self):
+        for kiosk_id, token in (("door-1", "guess"), ("door-2", self.token)):
+            transport = sync.SocketTransport("127.0.0.1", self.port, kiosk_id, token)
+            with self.assertRaises(ConnectionError):
+                transport.pull(0)
+            with self.assertRaises(ConnectionError):
+                transport.push(kiosk_id, [[1, 1, 1, "2024-01-01 00:00:00", "entry", "granted"]])
+        conn = sqlite3.connect(self.db_path)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM LabAccess").fetchone()[0], 0)
+        conn.close()
+
+
+class TemplateReplicationTest(unittest.TestCase):
+    def setUp(self):
+        self.paths = []
+        for _ in range(2):
+            handle, path = tempfile.mkstemp(suffix=".db")
+            os.close(handle)
+            self.paths.append(path)
+        self.central = sqlite3.connect(self.paths[0])
+        sync.install_change_log(self.central)
+        self.kiosk = sqlite3.connect(self.paths[1])
+        self.replica = sync.KioskSync(self.kiosk, sync.FileTransport(self.paths[0]), "door-1")
+
+    def tearDown(self):
+        self.central.close()
+        self.kiosk.close()
+        for path in self.paths:
+            os.remove(path)
+
+    def test_templates_arrive_tagged_with_their_model(self):
+        self.central.execute(
+            "INSERT INTO LabMember (member_id, first_name, face_template, template_model, face_ref) "
+            "VALUES (1, 'Ada', x'01', 'vggface2', 'r1')"
+        )
+        self.central.execute("INSERT INTO LabMemberTemplate VALUES (1, 'casia-webface', x'02', 'r1', 'then')")
+        self.central.commit()
+        self.replica.pull()
+        # a re-run replaces the (member, model) row under a new rowid
+        self.central.execute("INSERT OR REPLACE INTO LabMemberTemplate VALUES (1, 'casia-webface', x'03', 'r1', 'now')")
+        self.central.commit()
+        self.replica.pull()
+
+        self.assertEqual(self.kiosk.execute("SELECT template_model FROM LabMember").fetchall(), [("vggface2",)])
+        self.assertEqual(self.kiosk.execute("SELECT model, template FROM LabMemberTemplate").fetchall(),
+                         [("casia-webface", b"\x03")])
+
+
+if __name__ == "__main__":
+    unittest.main()
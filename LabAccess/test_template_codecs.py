@@ -0,0 +1,112 @@
+import unittest
+from unittest import mock
+
+try:
+    import numpy as np
+    import template_codecs
+    from template_codecs import Codebook, TemplateMatrix, decode_template, encode_template
+except ImportError:  # needs numpy
+    template_codecs = None
+
+GALLERY = 64
+
+# largest |distance - float32 distance| allowed per format, for unit vectors
+TOLERANCE = {"float32": 1e-5, "float16": 2e-4, "int8": 5e-3, "pq": 1e-5}
+
+
+def _unit_vectors(n, seed):
+    vectors = np.random.default_rng(seed).standard_normal((n, template_codecs.EMBEDDING_SIZE))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+@unittest.skipIf(template_codecs is None, "numpy is not installed")
+class _CodecTest(unittest.TestCase):
+    def setUp(self):
+        self.gallery = _unit_vectors(GALLERY, seed=1)
+        self.queries = _unit_vectors(8, seed=2)
+        # one centroid per gallery vector: k-means keeps every sub-vector as
+        # its own centroid, so pq stores the gallery exactly and only the
+        # asymmetric distance kernel is under test
+        self.codebook = Codebook(7, template_codecs.train_codebook(self.gallery, iterations=1))
+        self.codebooks = {7: self.codebook}
+
+    def encode_all(self, fmt):
+        return [encode_template(v, fmt, self.codebook) for v in self.gallery]
+
+    def exact(self, query):
+        return np.linalg.norm(self.gallery - query, axis=1)
+
+
+class RoundTripTest(_CodecTest):
+    def test_sizes_match_the_documented_layout(self):
+        sizes = {"float32": 2049, "float16": 1025, "int8": 517, "pq": 69}
+        for fmt, size in sizes.items():
+            blob = encode_template(self.gallery[0], fmt, self.codebook)
+            self.assertEqual(len(blob), size, fmt)
+            self.assertEqual(template_codecs.template_format(blob), fmt)
+
+    def test_float32_is_lossless(self):
+        for vector in self.gallery:
+            np.testing.assert_array_equal(decode_template(encode_template(vector)), vector)
+
+    def test_float16_round_trip(self):
+        for vector in self.gallery:
+            decoded = decode_template(encode_template(vector, "float16"))
+            np.testing.assert_allclose(decoded, vector, rtol=1e-3, atol=1e-6)
+
+    def test_int8_error_is_within_half_a_step(self):
+        for vector in self.gallery:
+            decoded = decode_template(encode_template(vector, "int8"))
+            step = np.abs(vector).max() / 127
+            self.assertLessEqual(np.abs(decoded - vector).max(), step / 2 + 1e-7)
+
+    def test_pq_decodes_through_its_codebook(self):
+        for vector in self.gallery:
+            decoded = decode_template(encode_template(vector, "pq", self.codebook), self.codebooks)
+            np.testing.assert_allclose(decoded, vector, atol=1e-6)
+
+    def test_pq_needs_a_codebook(self):
+        with self.assertRaises(ValueError):
+            encode_template(self.gallery[0], "pq")
+
+    def test_codebook_survives_serialization(self):
+        restored = Codebook.from_bytes(7, self.codebook.to_bytes())
+        np.testing.assert_array_equal(restored.centroids, self.codebook.centroids)
+
+
+class DistanceTest(_CodecTest):
+    def assert_close_to_float32(self, fmt, matrix):
+        for query in self.queries:
+            error = np.abs(matrix.distances(query) - self.exact(query)).max()
+            self.assertLess(error, TOLERANCE[fmt], fmt)
+
+    def test_each_format_tracks_float32(self):
+        for fmt in template_codecs.FORMATS:
+            self.assert_close_to_float32(fmt, TemplateMatrix(self.encode_all(fmt), self.codebooks))
+
+    def test_blocked_kernels_cover_every_row(self):
+        with mock.patch.object(template_codecs, "BLOCK_ROWS", 7):
+            for fmt in ("float16", "int8"):
+                self.assert_close_to_float32(fmt, TemplateMatrix(self.encode_all(fmt), self.codebooks))
+
+    def test_mixed_formats_keep_input_order(self):
+        formats = template_codecs.FORMATS
+        blobs = [encode_template(v, formats[i % len(formats)], self.codebook) for i, v in enumerate(self.gallery)]
+        matrix = TemplateMatrix(blobs, self.codebooks)
+        self.assertEqual(len(matrix), GALLERY)
+        for query in self.queries:
+            error = np.abs(matrix.distances(query) - self.exact(query))
+            for i, fmt in enumerate(formats):
+                self.assertLess(error[i::len(formats)].max(), TOLERANCE[fmt], fmt)
+
+    def test_nearest_member_is_unchanged(self):
+        # a noisy copy of each member must still find that member in every format
+        noisy = self.gallery + 0.05 * _unit_vectors(GALLERY, seed=3)
+        for fmt in template_codecs.FORMATS:
+            matrix = TemplateMatrix(self.encode_all(fmt), self.codebooks)
+            nearest = [int(matrix.distances(query).argmin()) for query in noisy]
+            self.assertEqual(nearest, list(range(GALLERY)), fmt)
+
+
+if __name__ == "__main__":
+    unittest.main()